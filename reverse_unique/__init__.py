@@ -1 +1,3 @@
+from .expressions import ReverseUniqueExists, ReverseUniqueSubquery  # noqa
 from .fields import ReverseUnique  # noqa
+from .query import ReverseUniqueQuerySet, aprefetch_variants, iter_with_reverse_unique, prefetch_variants  # noqa
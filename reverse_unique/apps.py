@@ -0,0 +1,21 @@
+from django.apps import AppConfig, apps
+from django.core import checks
+
+from .fields import ReverseUnique
+
+
+class ReverseUniqueConfig(AppConfig):
+    name = 'reverse_unique'
+
+    def ready(self):
+        from .checks import check_reverse_unique_fields
+        checks.register(check_reverse_unique_fields, checks.Tags.database)
+        for model in apps.get_models():
+            for field in model._meta.local_fields:
+                if not isinstance(field, ReverseUnique):
+                    continue
+                # Errors are reported by the field's system checks, the
+                # index can't be added for a misconfigured field.
+                errors = field.warm_up()
+                if field.remote_index and not errors:
+                    field.add_remote_index()
@@ -0,0 +1,189 @@
+import re
+
+from django.apps import apps
+from django.core import checks
+from django.db import DatabaseError, connections
+from django.db.models import Q, UniqueConstraint
+
+from .fields import ReverseUnique
+
+SEQ_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?'),
+    'postgresql': re.compile(r'\bSeq Scan on "?(\w+)"?'),
+}
+
+
+def get_reverse_unique_fields(app_configs=None):
+    if app_configs is None:
+        models = apps.get_models()
+    else:
+        models = [model for app_config in app_configs for model in app_config.get_models()]
+    for model in models:
+        for field in model._meta.local_fields:
+            if isinstance(field, ReverseUnique):
+                yield field
+
+
+def _index_field_lists(opts):
+    """
+    Yield (fields, condition) for each index of the model.
+    """
+    for field in opts.concrete_fields:
+        if field.db_index or field.unique:
+            yield [field.name], None
+    for index in opts.indexes:
+        yield [name.lstrip('-') for name in index.fields], index.condition
+    # index_together was removed in Django 5.1.
+    for fields in [*opts.unique_together, *getattr(opts, 'index_together', ())]:
+        yield list(fields), None
+    for constraint in opts.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields:
+            yield list(constraint.fields), constraint.condition
+
+
+def _unique_field_sets(opts):
+    """
+    Yield (fields, condition) for each uniqueness guarantee of the model.
+    """
+    for field in opts.concrete_fields:
+        if field.unique:
+            yield {field.name}, None
+    for fields in opts.unique_together:
+        yield set(fields), None
+    for constraint in opts.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields:
+            yield set(constraint.fields), constraint.condition
+
+
+def _equality_fields(field, filters):
+    """
+    Return the names of the remote fields the filters require to have a
+    single value per join.
+    """
+    names = set()
+    if not isinstance(filters, Q) or filters.negated or filters.connector != Q.AND:
+        return names
+    for child in filters.children:
+        if isinstance(child, Q):
+            names |= _equality_fields(field, child)
+            continue
+        for condition in field._filter_lookups(Q(child)):
+            if condition is not None and condition[1] == 'exact':
+                names.add(condition[0].name)
+    return names
+
+
+def is_provably_unique(field):
+    if field.materialize or field.order_by:
+        return True
+    if field.fallback:
+        return all(is_provably_unique(f) for f in field._fallback_fields)
+    filters = field.get_filters()
+    fk_names = {f.name for f in field.remote_fk.local_related_fields}
+    known = fk_names | _equality_fields(field, filters)
+    for fields, condition in _unique_field_sets(field.remote_field.model._meta):
+        if condition is not None and (condition != filters or callable(field.filters)):
+            continue
+        if fields <= known:
+            return True
+    return False
+
+
+def check_indexes(field):
+    if field.materialize or field.fallback:
+        return []
+    remote_opts = field.remote_field.model._meta
+    filters = field._get_base_filters()
+    fk_names = [f.name for f in field.remote_fk.local_related_fields]
+    wanted = list(fk_names)
+    for condition in field._filter_lookups(filters):
+        if condition is not None and condition[0].name not in wanted:
+            wanted.append(condition[0].name)
+    wanted.extend(name.lstrip('-') for name in field.order_by if name.lstrip('-') not in wanted + ['pk'])
+    for fields, condition in _index_field_lists(remote_opts):
+        if condition is None and set(fields[:len(wanted)]) == set(wanted):
+            return []
+        # A partial index restricted to the filters only needs the foreign key.
+        if condition is not None and condition == filters and set(fields[:len(fk_names)]) == set(fk_names):
+            return []
+    return [checks.Warning(
+        "No index on %s covers the columns %s used when joining through %s.%s."
+        % (remote_opts.label, ', '.join(wanted), field.model._meta.label, field.name),
+        hint="Add an index, for example by passing remote_index=True to the field.",
+        obj=field,
+        id='reverse_unique.W002',
+    )]
+
+
+def check_uniqueness(field):
+    if is_provably_unique(field):
+        return []
+    return [checks.Warning(
+        "The filters of %s.%s can't be proven to match at most one %s per %s."
+        % (field.model._meta.label, field.name, field.remote_field.model._meta.label,
+           field.model._meta.label),
+        hint="Add a unique constraint covering the foreign key and the filtered "
+             "columns, or make sure the data can't contain duplicate matches.",
+        obj=field,
+        id='reverse_unique.W003',
+    )]
+
+
+def check_query_plan(field, using='default'):
+    """
+    Run EXPLAIN for a select_related() query through field and warn if the
+    remote table is scanned sequentially. Only SQLite and PostgreSQL plans
+    are inspected.
+    """
+    connection = connections[using]
+    pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None or field.materialize:
+        return []
+    remote_table = field.remote_field.model._meta.db_table
+    models = [field.model, *field.model._meta.get_parent_list(), field.remote_field.model]
+    if not {model._meta.db_table for model in models}.issubset(connection.introspection.table_names()):
+        # Not migrated yet, for example when the checks run before migrate.
+        return []
+    qs = field.model._base_manager.using(using).select_related(field.name)
+    try:
+        plan = qs.explain()
+    except DatabaseError as e:
+        return [checks.Warning(
+            "Couldn't explain the query for %s.%s: %s" % (field.model._meta.label, field.name, e),
+            obj=field,
+            id='reverse_unique.W004',
+        )]
+    scanned = {table for table in pattern.findall(plan)}
+    if remote_table not in scanned and not any(re.match(r'RU\d+$', t) for t in scanned):
+        return []
+    return [checks.Warning(
+        "Joining through %s.%s scans the table %s sequentially."
+        % (field.model._meta.label, field.name, remote_table),
+        hint="Query plan:\n%s" % plan,
+        obj=field,
+        id='reverse_unique.W001',
+    )]
+
+
+def check_field(field, using=None):
+    if field.warm_up():
+        # Misconfigured, reported by the field's own checks.
+        return []
+    messages = [*check_indexes(field), *check_uniqueness(field)]
+    if using is not None:
+        messages.extend(check_query_plan(field, using))
+    return messages
+
+
+def check_reverse_unique_fields(app_configs=None, databases=None, **kwargs):
+    """
+    System check for the ReverseUnique fields of the project. Registered
+    with the database tag, so it only runs with check --database.
+    """
+    if not databases:
+        return []
+    messages = []
+    for field in get_reverse_unique_fields(app_configs):
+        for using in databases:
+            messages.extend(check_field(field, using))
+    return messages
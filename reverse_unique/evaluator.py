@@ -0,0 +1,156 @@
+import operator
+import unicodedata
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Model
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.tree import Node
+
+
+class CannotEvaluate(Exception):
+    """
+    The filters use something only the database can evaluate.
+    """
+
+
+def _isnull(value, arg):
+    return (value is None) == bool(arg)
+
+
+def _collation_key(value):
+    """
+    Normalize a string the way the most lenient collations compare (case,
+    accent and trailing space insensitive).
+    """
+    value = unicodedata.normalize('NFKD', value)
+    return ''.join(c for c in value if not unicodedata.combining(c)).casefold().rstrip()
+
+
+def _equals(value, arg):
+    if isinstance(value, str) and isinstance(arg, str) and value != arg:
+        # Whether 'foo' = 'FOO' depends on the collation of the column.
+        if _collation_key(value) == _collation_key(arg):
+            raise CannotEvaluate("%r = %r depends on the collation." % (value, arg))
+    return value == arg
+
+
+def _in(value, arg):
+    if None in arg:
+        # NULL in the list makes IN unknown instead of false.
+        raise CannotEvaluate("Can't evaluate IN with NULL values.")
+    return value is not None and any(_equals(value, item) for item in arg)
+
+
+def _compare(op):
+    def compare(value, arg):
+        if isinstance(value, str) or isinstance(arg, str):
+            raise CannotEvaluate("Ordering of strings depends on the collation.")
+        return op(value, arg)
+    return compare
+
+
+def _null_safe(lookup):
+    def evaluate(value, arg):
+        # Comparisons with NULL are never true in SQL.
+        return value is not None and arg is not None and lookup(value, arg)
+    return evaluate
+
+
+LOOKUPS = {
+    'exact': _null_safe(_equals),
+    'lt': _null_safe(_compare(operator.lt)),
+    'lte': _null_safe(_compare(operator.le)),
+    'gt': _null_safe(_compare(operator.gt)),
+    'gte': _null_safe(_compare(operator.ge)),
+    'isnull': _isnull,
+    'in': _in,
+}
+
+
+def _get_value(field, value):
+    """
+    Convert a lookup value to the Python value of field, as stored on model
+    instances (the attname value for foreign keys).
+    """
+    if value is None:
+        return None
+    if isinstance(value, Model):
+        return value.pk
+    if field.is_relation:
+        field = field.target_field
+    try:
+        return field.to_python(value)
+    except (ValidationError, TypeError):
+        raise CannotEvaluate("Can't convert %r for %s." % (value, field))
+
+
+class FilterEvaluator:
+    """
+    Evaluates the filters of a ReverseUnique field against already loaded
+    remote objects.
+
+    The supported conditions are the lookups in LOOKUPS on local fields of
+    the remote model. Values can be plain values, model instances and F()
+    references to local fields of the remote model or, through the foreign
+    key, to local fields of the instance owning the ReverseUnique field
+    (for example F('article__default_lang')). Pattern lookups, ordering of
+    strings, string equality which depends on the collation, and NULL
+    references are left to the database. Anything else raises
+    CannotEvaluate.
+    """
+    def __init__(self, remote_model, fk_name):
+        self.opts = remote_model._meta
+        self.fk_name = fk_name
+
+    def _get_field(self, opts, name):
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            raise CannotEvaluate("%s has no field %s." % (opts.label, name))
+        if not field.concrete:
+            raise CannotEvaluate("%s.%s isn't a concrete field." % (opts.label, name))
+        return field
+
+    def _resolve_f(self, ref, obj, owner):
+        parts = ref.name.split(LOOKUP_SEP)
+        if len(parts) == 1:
+            return getattr(obj, self._get_field(self.opts, parts[0]).attname)
+        if len(parts) == 2 and parts[0] == self.fk_name and owner is not None:
+            return getattr(owner, self._get_field(owner._meta, parts[1]).attname)
+        raise CannotEvaluate("Can't follow %s." % ref.name)
+
+    def _evaluate_condition(self, path, arg, obj, owner):
+        parts = path.split(LOOKUP_SEP)
+        field = self._get_field(self.opts, parts[0])
+        lookup = LOOKUP_SEP.join(parts[1:]) or 'exact'
+        if lookup not in LOOKUPS:
+            raise CannotEvaluate("Unsupported lookup %s." % path)
+        if lookup == 'exact' and arg is None:
+            lookup, arg = 'isnull', True
+        if isinstance(arg, F):
+            arg = self._resolve_f(arg, obj, owner)
+            if arg is None:
+                # Django only guards the left-hand side against NULL when
+                # negating, so ~Q(field=F(...)) depends on NULL semantics.
+                raise CannotEvaluate("%s references a NULL value." % path)
+        elif hasattr(arg, 'resolve_expression'):
+            raise CannotEvaluate("Can't evaluate %r." % arg)
+        elif lookup == 'in':
+            arg = [_get_value(field, value) for value in arg]
+        elif lookup != 'isnull':
+            arg = _get_value(field, arg)
+        return LOOKUPS[lookup](getattr(obj, field.attname), arg)
+
+    def evaluate(self, filters, obj, owner=None):
+        """
+        Return True if obj matches filters (a Q object or a dict of lookups).
+        """
+        if isinstance(filters, dict):
+            return all(self._evaluate_condition(path, arg, obj, owner) for path, arg in filters.items())
+        if isinstance(filters, Node):
+            results = (self.evaluate(child, obj, owner) for child in filters.children)
+            result = any(results) if filters.connector == 'OR' else all(results)
+            return not result if filters.negated else result
+        if isinstance(filters, tuple) and len(filters) == 2:
+            return self._evaluate_condition(filters[0], filters[1], obj, owner)
+        raise CannotEvaluate("Can't evaluate %r." % (filters,))
@@ -0,0 +1,70 @@
+from django.db.models import BooleanField, Exists, Expression, Subquery
+from django.db.models.constants import LOOKUP_SEP
+
+
+class ReverseUniqueExpression(Expression):
+    """
+    Base class for expressions compiling a ReverseUnique relation of the
+    query's model to a correlated subquery instead of a join. The subquery
+    is built when the expression is resolved against the query.
+    """
+    def __init__(self, lookup, output_field=None):
+        super().__init__(output_field=output_field)
+        self.lookup = lookup
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.lookup)
+
+    def _get_queryset(self, model):
+        name, *rest = self.lookup.split(LOOKUP_SEP)
+        field = model._meta.get_field(name)
+        if not hasattr(field, 'get_correlated_queryset'):
+            raise ValueError("%s.%s isn't a ReverseUnique field." % (model._meta.label, name))
+        return field.get_correlated_queryset(), LOOKUP_SEP.join(rest)
+
+    def as_expression(self, model):
+        raise NotImplementedError
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        return self.as_expression(query.model).resolve_expression(
+            query, allow_joins, reuse, summarize, for_save)
+
+
+class ReverseUniqueExists(ReverseUniqueExpression):
+    """
+    True when the ReverseUnique field has a match, compiled to EXISTS(...):
+
+        Article.objects.filter(ReverseUniqueExists('active_translation'))
+
+    Filters on the remote object can be added with keyword arguments, and
+    ~ReverseUniqueExists(...) compiles to NOT EXISTS(...).
+    """
+    output_field = BooleanField()
+
+    def __init__(self, lookup, negated=False, **filters):
+        super().__init__(lookup)
+        self.negated = negated
+        self.filters = filters
+
+    def __invert__(self):
+        return type(self)(self.lookup, negated=not self.negated, **self.filters)
+
+    def as_expression(self, model):
+        qs, rest = self._get_queryset(model)
+        if rest:
+            raise ValueError("ReverseUniqueExists() takes a field name, got %s." % self.lookup)
+        exists = Exists(qs.filter(**self.filters))
+        # Django 4.2 dropped Exists(negated=...) in favour of inversion.
+        return ~exists if self.negated else exists
+
+
+class ReverseUniqueSubquery(ReverseUniqueExpression):
+    """
+    A value of the ReverseUnique field's match, compiled to a correlated
+    scalar subquery:
+
+        Article.objects.annotate(title=ReverseUniqueSubquery('active_translation__title'))
+    """
+    def as_expression(self, model):
+        qs, rest = self._get_queryset(model)
+        return Subquery(qs.values(rest or 'pk')[:1], output_field=self._output_field_or_none)
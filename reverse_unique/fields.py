@@ -1,31 +1,266 @@
+import logging
+import operator
+import random
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from functools import partialmethod, reduce, wraps
+from itertools import product
+from threading import Lock
+
 import django
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import models, router, transaction
+from django.db.backends.utils import names_digest
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, signals
+from django.db.models.constants import LOOKUP_SEP
 from django.db.models.fields.related import ForeignObject
 from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+from django.db.models.sql.query import Query
+from django.utils.functional import cached_property
+from django.utils.hashable import make_hashable
+from django.utils.tree import Node
+
+from . import instrumentation
+from .evaluator import CannotEvaluate, FilterEvaluator
+from .loader import get_loader
+from .signals import duplicate_match
+
+logger = logging.getLogger('reverse_unique')
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+ProbeInfo = namedtuple('ProbeInfo', ['probes', 'violations', 'throttled'])
+SharedCacheInfo = namedtuple('SharedCacheInfo', ['hits', 'misses', 'invalidations'])
+
+
+def _find_subqueries(node):
+    if isinstance(node, Query):
+        yield node
+    elif isinstance(node, Node):
+        for child in node.children:
+            yield from _find_subqueries(child)
+    elif hasattr(node, 'get_source_expressions'):
+        for child in node.get_source_expressions():
+            yield from _find_subqueries(child)
+
+
+class MaterializedForeignKey(models.ForeignKey):
+    """
+    The column storing the current match of a ReverseUnique(materialize=True).
+    The ReverseUnique adds this field to its model, so the field isn't added
+    again if the model already has it (for example in migration states).
+    """
+    def contribute_to_class(self, cls, name, **kwargs):
+        if any(f.name == name for f in cls._meta.local_fields):
+            return
+        super().contribute_to_class(cls, name, **kwargs)
+
+
+async def _aget_reverse_unique(instance, field):
+    return await getattr(type(instance), field.name).aget(instance)
+
+
+def _clearing_reverse_unique_caches(refresh_from_db):
+    """
+    Wrap Model.refresh_from_db() to also clear the cached ReverseUnique values
+    which may be stale after the refresh. Django only clears the caches of
+    concrete relations.
+    """
+    @wraps(refresh_from_db)
+    def wrapper(self, using=None, fields=None, *args, **kwargs):
+        refresh_from_db(self, using, fields, *args, **kwargs)
+        for field in self._meta.fields:
+            if isinstance(field, ReverseUnique) and (
+                    fields is None or {f.attname for f in field.local_related_fields} & set(fields)):
+                field.clear_cached_values(self)
+    wrapper.clears_reverse_unique_caches = True
+    return wrapper
 
 
 class ReverseUniqueDescriptor(ForwardManyToOneDescriptor):
     def __set__(self, instance, value):
         if instance is None:
             raise AttributeError("%s must be accessed via instance" % self.field.name)
-        instance.__dict__[self.field.get_cache_name()] = value
-        if value is not None and not self.field.remote_field.multiple:
-            setattr(value, self.field.related.get_cache_name(), instance)
+        self.field.set_cached_value(instance, value)
 
     def __get__(self, instance, *args, **kwargs):
+        if instance is None:
+            return self
+        if not self.field.cache_variants and not instrumentation.collector.enabled:
+            # Cached values need no bookkeeping when no collector is installed.
+            try:
+                return instance._state.fields_cache[self.field.get_cache_name()]
+            except KeyError:
+                pass
+        was_cached = self.is_cached(instance)
+        rel_obj = self._get(instance, was_cached, *args, **kwargs)
+        collector = instrumentation.collector
+        if collector.enabled:
+            collector.record(self.field, 'cache_hit' if was_cached else 'cache_miss')
+            if rel_obj is None:
+                collector.record(self.field, 'none_result')
+        return rel_obj
+
+    def _get(self, instance, was_cached, *args, **kwargs):
+        if not was_cached:
+            try:
+                rel_obj = self.field.match_prefetched(instance)
+            except CannotEvaluate:
+                pass
+            else:
+                self.field.set_cached_value(instance, rel_obj)
+                return rel_obj
+        loader = get_loader()
+        if not was_cached and self.field.cache_alias is not None:
+            rel_obj = self.field.cache_get_many([instance])[0]
+        elif not was_cached and loader is not None:
+            rel_obj = loader.load(self.field, instance)
+        elif self.field.cache_variants:
+            rel_obj = self._get_variant(instance)
+        else:
+            try:
+                rel_obj = super().__get__(instance, *args, **kwargs)
+            except self.field.remote_field.model.DoesNotExist:
+                self.field.set_cached_value(instance, None)
+                rel_obj = None
+        if not was_cached:
+            self.field.maybe_probe(instance._state.db)
+        return rel_obj
+
+    def get_object(self, instance):
+        with instrumentation.timer(self.field, 'query'):
+            return super().get_object(instance)
+
+    def is_cached(self, instance):
+        if self.field.cache_variants:
+            return self.field._variant_cache_key() in instance._state.fields_cache
+        return super().is_cached(instance)
+
+    def _get_variant(self, instance):
+        """
+        Return the related object matching the filters in effect right now.
+        Each filter value gets its own cache slot on the instance, so
+        switching for example the active language doesn't serve a stale row.
+        """
+        key = self.field._variant_cache_key()
+        if key is not None and key in instance._state.fields_cache:
+            return instance._state.fields_cache[key]
+        if None in self.field.get_local_related_value(instance):
+            rel_obj = None
+        else:
+            try:
+                rel_obj = self.get_object(instance)
+            except self.field.remote_field.model.DoesNotExist:
+                rel_obj = None
+        self.field.set_cached_value(instance, rel_obj)
+        return rel_obj
+
+    async def aget(self, instance):
+        """
+        Async version of attribute access: return the related object, loading
+        it through the async queryset API if it isn't cached yet.
+        """
+        if self.is_cached(instance):
+            return self.__get__(instance)
+        rel_obj = await self._aget(instance)
+        collector = instrumentation.collector
+        if collector.enabled:
+            collector.record(self.field, 'cache_miss')
+            if rel_obj is None:
+                collector.record(self.field, 'none_result')
+        return rel_obj
+
+    async def _aget(self, instance):
+        field = self.field
         try:
-            return super().__get__(instance, *args, **kwargs)
-        except self.field.remote_field.model.DoesNotExist:
-            instance.__dict__[self.field.get_cache_name()] = None
-            return None
+            rel_obj = field.match_prefetched(instance)
+        except CannotEvaluate:
+            pass
+        else:
+            field.set_cached_value(instance, rel_obj)
+            return rel_obj
+        if field.cache_alias is not None:
+            return (await sync_to_async(field.cache_get_many)([instance]))[0]
+        loader = get_loader()
+        if loader is not None:
+            rel_obj = await loader.aload(field, instance)
+            if field.probe_rate:
+                await sync_to_async(field.maybe_probe)(instance._state.db)
+            return rel_obj
+        rel_obj = None
+        if None not in field.get_local_related_value(instance):
+            qs = self.get_queryset(instance=instance).filter(field.get_reverse_related_filter(instance))
+            try:
+                with instrumentation.timer(field, 'query'):
+                    if django.VERSION >= (4, 1):
+                        rel_obj = await qs.aget()
+                    else:
+                        rel_obj = await sync_to_async(qs.get)()
+            except field.remote_field.model.DoesNotExist:
+                pass
+        field.set_cached_value(instance, rel_obj)
+        if field.probe_rate:
+            await sync_to_async(field.maybe_probe)(instance._state.db)
+        return rel_obj
+
+    def _get_prefetch_queryset(self, queryset):
+        if queryset is None:
+            queryset = self.get_queryset()
+        if self.field.materialize:
+            return queryset
+        return queryset.filter(self.field.get_filters())
+
+    if django.VERSION[0] >= 5:
+        def get_prefetch_querysets(self, instances, querysets=None):
+            queryset = self._get_prefetch_queryset(querysets[0] if querysets else None)
+            return self._as_descriptor_prefetch(
+                super().get_prefetch_querysets(instances, [queryset]))
+    else:
+        def get_prefetch_queryset(self, instances, queryset=None):
+            queryset = self._get_prefetch_queryset(queryset)
+            return self._as_descriptor_prefetch(
+                super().get_prefetch_queryset(instances, queryset))
+
+    def _as_descriptor_prefetch(self, prefetch):
+        # Assign the prefetched objects through __set__ so that the variant
+        # cache gets populated, too.
+        return prefetch[:4] + (self.field.name, True)
 
 
 class ReverseUnique(ForeignObject):
     requires_unique_target = False
+    # How many compiled restrictions (one per distinct filter value) to keep.
+    filter_cache_size = 128
+    # How many duplicated foreign key values a probe reports at most.
+    probe_limit = 10
 
     def __init__(self, *args, **kwargs):
-        self.filters = kwargs.pop('filters')
+        self.fallback = tuple(kwargs.pop('fallback', ()))
+        self.order_by = tuple(kwargs.pop('order_by', ()))
+        if self.fallback or self.order_by:
+            self.filters = kwargs.pop('filters', None)
+        else:
+            self.filters = kwargs.pop('filters')
         self.through = kwargs.pop('through', None)
+        self.cache_variants = kwargs.pop('cache_variants', False)
+        self.materialize = kwargs.pop('materialize', False)
+        self.remote_index = kwargs.pop('remote_index', False)
+        self.probe_rate = kwargs.pop('probe_rate', 0)
+        self.probe_interval = kwargs.pop('probe_interval', 60)
+        cache = kwargs.pop('cache', None)
+        self.cache_alias = DEFAULT_CACHE_ALIAS if cache is True else cache
+        self.cache_timeout = kwargs.pop('cache_timeout', DEFAULT_TIMEOUT)
+        self.auto_select = kwargs.pop('auto_select', False)
+        self.auto_select_fields = kwargs.pop('auto_select_fields', None)
+        if self.auto_select_fields is not None:
+            self.auto_select_fields = tuple(self.auto_select_fields)
+        self._init_filter_cache()
+        self._init_probe_state()
+        self._init_shared_cache_info()
         kwargs['from_fields'] = []
         kwargs['to_fields'] = []
         kwargs['null'] = True
@@ -33,40 +268,110 @@ class ReverseUnique(ForeignObject):
         kwargs['on_delete'] = models.DO_NOTHING
         super().__init__(*args, **kwargs)
 
-    def resolve_related_fields(self):
-        if self.through is None:
-            possible_models = [self.model] + [m for m in self.model.__mro__ if hasattr(m, '_meta')]
-            possible_targets = [f for f in self.remote_field.model._meta.concrete_fields
-                                if f.remote_field and f.remote_field.model in possible_models]
-            if len(possible_targets) != 1:
-                raise Exception("Found %s target fields instead of one, the fields found were %s."
-                                % (len(possible_targets), [f.name for f in possible_targets]))
-            related_field = possible_targets[0]
-        else:
-            related_field = self.model._meta.get_field(self.through).field
+    @cached_property
+    def remote_fk(self):
+        """
+        The foreign key of the remote model this field is the reverse of.
+        """
+        possible_models = [self.model] + [m for m in self.model.__mro__ if hasattr(m, '_meta')]
+        candidates = [f for f in self.remote_field.model._meta.fields
+                      if f.remote_field and f.remote_field.model in possible_models
+                      and not isinstance(f, ReverseUnique)]
+        if self.through is not None:
+            # Not using self.model._meta.get_field(), reverse relations aren't
+            # available before the app registry is ready.
+            candidates = [f for f in candidates if f.related_query_name() == self.through]
+            if not candidates:
+                raise FieldDoesNotExist("%s has no field named '%s'"
+                                        % (self.model._meta.object_name, self.through))
+        # Multi-column foreign keys are ForeignObjects, which aren't concrete.
+        # They are only used if there's no concrete foreign key, a
+        # ForeignObject may well be defined next to one.
+        possible_targets = [f for f in candidates if f.concrete] or candidates
+        if len(possible_targets) != 1:
+            raise ValueError("Found %s target fields instead of one, the fields found were %s."
+                             % (len(possible_targets), [f.name for f in possible_targets]))
+        return possible_targets[0]
+
+    def _get_join_fields(self):
+        """
+        Return the names of the local and remote fields joined when following
+        the remote foreign key in reverse.
+        """
+        related_field = self.remote_fk
         if related_field.remote_field.model._meta.concrete_model != self.model._meta.concrete_model:
             # We have found a foreign key pointing to parent model.
-            # This will only work if the fk is pointing to a value
+            # This will only work if the fk is pointing to values
             # that can be found from the child model, too. This is
-            # the case only when we have parent pointer in child
-            # pointing to same field as the found foreign key is
-            # pointing to. Lets find this out. And, lets handle
-            # only the single column case for now.
-            if len(related_field.to_fields) > 1:
-                raise ValueError(
-                    "FIXME: No support for multi-column joins in parent join case."
-                )
+            # the case when we have parent pointer in child pointing
+            # to same field as the found foreign key is pointing to,
+            # and the rest of the columns are stored in the child
+            # table, too. Lets find this out.
             to_fields = self._find_parent_link(related_field)
         else:
             to_fields = [f.name for f in related_field.foreign_related_fields]
-        self.to_fields = [f.name for f in related_field.local_related_fields]
-        self.from_fields = to_fields
-        return super().resolve_related_fields()
+        return to_fields, [f.name for f in related_field.local_related_fields]
+
+    def resolve_related_fields(self):
+        if self.materialize:
+            self.from_fields = [self.materialized_name]
+            self.to_fields = [self.remote_field.model._meta.pk.name]
+        else:
+            self.from_fields, self.to_fields = self._get_join_fields()
+        related_fields = super().resolve_related_fields()
+        for field in self._fallback_fields:
+            if (field.remote_field.model != self.remote_field.model
+                    or field.remote_fk != self.remote_fk):
+                raise ValueError(
+                    "The fallback fields of %s.%s must be ReverseUnique fields of the "
+                    "same relation, %s isn't." % (self.model._meta.label, self.name, field.name))
+        return related_fields
+
+    def check(self, **kwargs):
+        return [*super().check(**kwargs), *self.warm_up()]
+
+    def warm_up(self):
+        """
+        Resolve the relation metadata (the remote foreign key, the joined
+        fields and parent links) and compile the restriction of filters that
+        aren't callables, so that the first query doesn't have to. Return the
+        configuration problems found as a list of checks.Error.
+        """
+        if isinstance(self.remote_field.model, str):
+            # ForeignObject's checks report the unresolved model.
+            return []
+        try:
+            self.remote_fk
+        except (FieldDoesNotExist, ValueError) as e:
+            return [checks.Error(str(e), obj=self, id='reverse_unique.E001')]
+        try:
+            self._get_join_fields()
+        except ValueError as e:
+            return [checks.Error(str(e), obj=self, id='reverse_unique.E002')]
+        try:
+            self.related_fields
+        except (FieldDoesNotExist, ValueError) as e:
+            return [checks.Error(str(e), obj=self, id='reverse_unique.E003')]
+        self._shared_join_field
+        if django.VERSION >= (4, 1):
+            self.path_infos
+        if not any(callable(f.filters) for f in [self, *self._fallback_fields]):
+            try:
+                self._get_restriction_template()
+            except (FieldError, ValueError) as e:
+                return [checks.Error(
+                    "The filters of %s.%s are invalid: %s" % (self.model._meta.label, self.name, e),
+                    obj=self, id='reverse_unique.E004')]
+        return []
 
     def _find_parent_link(self, related_field):
         """
-        Find a field containing the value of related_field in local concrete
-        fields or raise an error if the value isn't available in local table.
+        Find the local concrete fields containing the values related_field
+        points to, or raise an error if a value isn't available in local
+        table. The parent's primary key is found through the parent link, the
+        other columns of a multi-column foreign key must be stored in local
+        fields with the same column name (for example a tenant_id column
+        copied to the child table).
 
         Technical reason for this is that parent model joining is done later
         than filter join production, and that means proucing a join against
@@ -79,70 +384,933 @@ class ReverseUnique(ForeignObject):
         while True:
             found_link = curr_model._meta.get_ancestor_link(related_field.remote_field.model)
             if not found_link:
-                # OK, we found to parent model. Lets check that the pointed to
-                # field contains the correct value.
-                last_link = ancestor_links[-1]
-                if last_link.foreign_related_fields != related_field.foreign_related_fields:
-                    curr_opts = curr_model._meta
-                    rel_opts = self.remote_field.model._meta
-                    opts = self.model._meta
-                    raise ValueError(
-                        "The field(s) %s of model %s.%s which %s.%s.%s is "
-                        "pointing to cannot be found from %s.%s. "
-                        "Add ReverseUnique to parent instead." % (
-                            ', '.join([f.name for f in related_field.foreign_related_fields]),
-                            curr_opts.app_label, curr_opts.object_name,
-                            rel_opts.app_label, rel_opts.object_name, related_field.name,
-                            opts.app_label, opts.object_name
-                        )
-                    )
                 break
             if ancestor_links:
                 assert found_link.local_related_fields == ancestor_links[-1].foreign_related_fields
             ancestor_links.append(found_link)
             curr_model = found_link.remote_field.model
-        return [self.model._meta.get_ancestor_link(related_field.remote_field.model).name]
+        # OK, we found the parent model. Lets check that the pointed to
+        # fields contain the correct values.
+        parent_link_targets = ancestor_links[-1].foreign_related_fields
+        local_fields = [f for f in self.model._meta.local_concrete_fields if not f.primary_key]
+        to_fields = []
+        missing = []
+        for target in related_field.foreign_related_fields:
+            if target in parent_link_targets:
+                to_fields.append(ancestor_links[0].name)
+                continue
+            matches = [f.name for f in local_fields if f.column == target.column]
+            if matches:
+                to_fields.append(matches[0])
+            else:
+                missing.append(target)
+        if missing:
+            curr_opts = curr_model._meta
+            rel_opts = self.remote_field.model._meta
+            opts = self.model._meta
+            raise ValueError(
+                "The field(s) %s of model %s.%s which %s.%s.%s is "
+                "pointing to cannot be found from %s.%s. "
+                "Add ReverseUnique to parent instead." % (
+                    ', '.join([f.name for f in missing]),
+                    curr_opts.app_label, curr_opts.object_name,
+                    rel_opts.app_label, rel_opts.object_name, related_field.name,
+                    opts.app_label, opts.object_name
+                )
+            )
+        return to_fields
+
+    @cached_property
+    def _fallback_fields(self):
+        return [self.model._meta.get_field(name) for name in self.fallback]
+
+    @cached_property
+    def _shared_join_field(self):
+        """
+        The field whose join this field uses in queries. Fields declared with
+        the same remote model, join columns and filters share the join of the
+        first of them, so that a query using several of them joins the remote
+        table once (Django reuses a join when its join field is equal).
+        """
+        if self.materialize:
+            return self
+        definition = self._join_definition()
+        for field in self.model._meta.local_fields:
+            if field is self:
+                break
+            if isinstance(field, ReverseUnique) and not field.materialize and \
+                    field._join_definition() == definition:
+                return field
+        return self
+
+    def _join_definition(self):
+        # The filters are compared as declared: callables by identity, so
+        # that fields only share a join if they match the same rows whatever
+        # the callables return.
+        return (
+            self.remote_field.model, [(lh.column, rh.column) for lh, rh in self.related_fields],
+            self.filters, self.order_by, self.fallback,
+        )
+
+    @cached_property
+    def _evaluator(self):
+        return FilterEvaluator(self.remote_field.model, self.remote_fk.name)
+
+    def match_prefetched(self, instance):
+        """
+        Return the related object of instance chosen by evaluating the filters
+        in Python against the prefetched reverse relation of the remote
+        foreign key (for example prefetch_related('reservations')). Raise
+        CannotEvaluate if it isn't prefetched, was prefetched with a custom
+        queryset, or the filters need the database.
+        """
+        if self.materialize:
+            raise CannotEvaluate("Materialized fields are loaded by primary key.")
+        if self.fallback:
+            for field in self._fallback_fields:
+                rel_obj = field.match_prefetched(instance)
+                if rel_obj is not None:
+                    return rel_obj
+            return None
+        try:
+            candidates = instance._prefetched_objects_cache[self.remote_fk.remote_field.get_accessor_name()]
+        except (AttributeError, KeyError):
+            raise CannotEvaluate("%s isn't prefetched." % self.remote_fk.remote_field.get_accessor_name())
+        # Only the foreign key condition is allowed, a Prefetch() with a
+        # filtered queryset might not contain the match.
+        query = getattr(candidates, 'query', None)
+        if query is None or query.is_sliced or len(query.where.children) != 1:
+            raise CannotEvaluate("The prefetched queryset is filtered.")
+        filters = self.get_filters()
+        matches = [obj for obj in candidates if self._evaluator.evaluate(filters, obj, instance)]
+        if len(matches) > 1:
+            raise self.remote_field.model.MultipleObjectsReturned(
+                "%s.%s matched %s prefetched objects." % (self.model._meta.label, self.name, len(matches)))
+        return matches[0] if matches else None
 
     def get_filters(self):
+        if self.fallback:
+            return self._get_fallback_filters()
+        if self.order_by:
+            return self._get_ordered_filters()
+        return self._get_base_filters()
+
+    def _get_base_filters(self):
+        """
+        Return the filters given to the field, without the ordering or
+        fallback conditions.
+        """
         if callable(self.filters):
             return self.filters()
+        elif self.filters is None:
+            return Q()
         else:
             return self.filters
 
-    def _get_extra_restriction(self, alias, related_alias):
+    def _get_ordered_filters(self, filters=None):
+        """
+        Restrict the filters (default: the resolved base filters) to the first
+        matching remote row of each object in order_by order, by comparing
+        the primary key to a correlated subquery. The primary key breaks ties.
+        """
+        if filters is None:
+            filters = self._get_base_filters()
+        order_by = self.order_by
+        if not {'pk', '-pk'} & set(order_by):
+            order_by += ('pk',)
+        correlation = {f.attname: OuterRef(f.attname) for f in self.remote_fk.local_related_fields}
+        first = self.remote_field.model._base_manager.filter(**correlation).filter(
+            filters).order_by(*order_by).values('pk')[:1]
+        return Q(filters) & Q(pk=Subquery(first))
+
+    def _get_fallback_filters(self, component_filters=None):
+        """
+        Combine the filters of the fallback fields (default: their resolved
+        filters) so that a remote row matches the first field in the chain
+        that has a match.
+        """
+        if component_filters is None:
+            component_filters = [field.get_filters() for field in self._fallback_fields]
+        remote_model = self.remote_field.model
+        fk = self.remote_fk
+        correlation = {f.attname: OuterRef(f.attname) for f in fk.local_related_fields}
+        combined = Q()
+        previous = []
+        for filters in component_filters:
+            condition = Q(filters)
+            if previous:
+                earlier_match = remote_model._base_manager.filter(**correlation).filter(
+                    reduce(operator.or_, previous))
+                condition &= ~Exists(earlier_match)
+            combined |= condition
+            previous.append(Q(filters))
+        return combined
+
+    def _get_filters_key(self):
+        """
+        Return a hashable key for the filters in effect right now, or None if
+        the filters can't be hashed.
+        """
+        if self.fallback:
+            keys = tuple(field._get_filters_key() for field in self._fallback_fields)
+            return None if None in keys else ('fallback',) + keys
+        if self.order_by:
+            key = self._filter_cache_key(self._get_base_filters())
+            return None if key is None else ('order_by', self.order_by, key)
+        return self._filter_cache_key(self.get_filters())
+
+    def _resolve_filters(self):
+        """
+        Resolve callable filters once and return (resolved, key), where key
+        is the key of the filters (see _get_filters_key()) and
+        _combine_filters(resolved) builds the filters, so that both describe
+        the same value.
+        """
+        if self.fallback:
+            resolved = [field._resolve_filters() for field in self._fallback_fields]
+            keys = tuple(key for value, key in resolved)
+            return [value for value, key in resolved], None if None in keys else ('fallback',) + keys
+        filters = self._get_base_filters()
+        key = self._filter_cache_key(filters)
+        if self.order_by and key is not None:
+            key = ('order_by', self.order_by, key)
+        return filters, key
+
+    def _combine_filters(self, resolved):
+        if self.fallback:
+            return self._get_fallback_filters([
+                field._combine_filters(value) for field, value in zip(self._fallback_fields, resolved)])
+        if self.order_by:
+            return self._get_ordered_filters(resolved)
+        return resolved
+
+    def _filter_cache_key(self, filters):
+        """
+        Return a hashable key for resolved filters, or None if the filters
+        can't be hashed (and so the compiled restriction can't be cached).
+        """
+        if isinstance(filters, Q):
+            filters = filters.deconstruct()
+        try:
+            key = make_hashable(filters)
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _build_restriction(self, filters):
+        with instrumentation.timer(self, 'restriction_build'):
+            return self._compile_restriction(filters)
+
+    def _compile_restriction(self, filters):
         remote_model = self.remote_field.model
-        qs = remote_model.objects.filter(self.get_filters()).query
+        qs = remote_model.objects.filter(filters).query
         my_table = self.model._meta.db_table
         rel_table = remote_model._meta.db_table
         illegal_tables = set([t for t in qs.alias_map if qs.alias_refcount[t] > 0]).difference(
             set([my_table, rel_table]))
         if illegal_tables:
-            raise Exception("This field's filters refers illegal tables: %s" % illegal_tables)
-        where = qs.where
-        where.relabel_aliases({my_table: related_alias, rel_table: alias})
+            raise ValueError("This field's filters refers illegal tables: %s" % illegal_tables)
+        # Subqueries were given aliases relative to qs, but the restriction
+        # ends up in some other query, possibly itself a subquery using the
+        # same aliases. Rename them to aliases Django never generates.
+        for subquery in _find_subqueries(qs.where):
+            subquery.change_aliases({
+                alias: 'RU%s' % pos for pos, alias in enumerate(subquery.alias_map)
+            })
+        return qs.where
+
+    def _get_restriction_template(self):
+        """
+        Return the WhereNode for the current filters, using the table names of
+        the local and remote model as aliases. The returned node is shared
+        and must not be modified, use relabeled_clone() instead.
+        """
+        resolved, key = self._resolve_filters()
+        if key is None:
+            self._filter_cache_misses += 1
+            return self._build_restriction(self._combine_filters(resolved))
+        with self._filter_cache_lock:
+            where = self._filter_cache.get(key)
+            if where is not None:
+                self._filter_cache.move_to_end(key)
+                self._filter_cache_hits += 1
+                return where
+            self._filter_cache_misses += 1
+        where = self._build_restriction(self._combine_filters(resolved))
+        with self._filter_cache_lock:
+            self._filter_cache[key] = where
+            while len(self._filter_cache) > self.filter_cache_size:
+                self._filter_cache.popitem(last=False)
         return where
 
+    def _init_filter_cache(self):
+        self._filter_cache = OrderedDict()
+        self._filter_cache_lock = Lock()
+        self._filter_cache_hits = 0
+        self._filter_cache_misses = 0
+
+    def filter_cache_info(self):
+        with self._filter_cache_lock:
+            return CacheInfo(self._filter_cache_hits, self._filter_cache_misses,
+                             self.filter_cache_size, len(self._filter_cache))
+
+    def filter_cache_clear(self):
+        with self._filter_cache_lock:
+            self._filter_cache.clear()
+            self._filter_cache_hits = self._filter_cache_misses = 0
+
+    def _init_probe_state(self):
+        self._probe_lock = Lock()
+        self._probe_last = None
+        self._probes = self._probe_violations = self._probes_throttled = 0
+
+    def probe_info(self):
+        with self._probe_lock:
+            return ProbeInfo(self._probes, self._probe_violations, self._probes_throttled)
+
+    def find_duplicate_matches(self, using=None):
+        """
+        Return the foreign key values (as tuples) for which more than one
+        remote row matches the filters, at most probe_limit of them.
+        """
+        fk_attnames = [f.attname for f in self.remote_fk.local_related_fields]
+        qs = self.remote_field.model._base_manager.db_manager(using).filter(self.get_filters())
+        qs = qs.values(*fk_attnames).annotate(
+            reverse_unique_matches=Count('pk')).filter(reverse_unique_matches__gt=1)
+        return list(qs.values_list(*fk_attnames)[:self.probe_limit])
+
+    def probe(self, using=None):
+        """
+        Check the remote table for duplicate matches, and report them through
+        the 'reverse_unique' logger and the duplicate_match signal.
+        """
+        duplicates = self.find_duplicate_matches(using)
+        with self._probe_lock:
+            self._probes += 1
+            if duplicates:
+                self._probe_violations += 1
+        if duplicates:
+            logger.warning(
+                "%s.%s matches more than one %s for %s=%s.",
+                self.model._meta.label, self.name, self.remote_field.model._meta.label,
+                ','.join(f.attname for f in self.remote_fk.local_related_fields),
+                ', '.join(str(v[0]) if len(v) == 1 else str(v) for v in duplicates))
+            duplicate_match.send(sender=self.model, field=self, values=duplicates, using=using)
+        return duplicates
+
+    def maybe_probe(self, using=None):
+        """
+        Probe for duplicate matches with probability probe_rate, but at most
+        once per probe_interval seconds. Called after the queries loading the
+        field, never from inside them.
+        """
+        if (not self.probe_rate or self.materialize or self.order_by
+                or random.random() >= self.probe_rate):
+            return
+        now = time.monotonic()
+        with self._probe_lock:
+            if self._probe_last is not None and now - self._probe_last < self.probe_interval:
+                self._probes_throttled += 1
+                return
+            self._probe_last = now
+        self.probe(using)
+
+    def _init_shared_cache_info(self):
+        self._shared_cache_lock = Lock()
+        self._shared_cache_hits = self._shared_cache_misses = self._shared_cache_invalidations = 0
+
+    def shared_cache_info(self):
+        with self._shared_cache_lock:
+            return SharedCacheInfo(self._shared_cache_hits, self._shared_cache_misses,
+                                   self._shared_cache_invalidations)
+
+    def _shared_cache_key(self, kind, using, *parts):
+        return 'reverse_unique:%s.%s:%s:%s' % (
+            self.model._meta.label_lower, self.name, kind,
+            names_digest(using, *map(repr, parts), length=16))
+
+    def cache_get_many(self, instances):
+        """
+        Return the related objects of instances (a list, in the same order),
+        reading them from the shared cache in one round trip and loading the
+        rest with one query per database.
+
+        Cache entries are keyed by the related value of the instance and the
+        filter value in effect. They are invalidated by saving or deleting
+        remote objects or instances, bulk updates aren't noticed.
+        """
+        cache = caches[self.cache_alias]
+        filters_key = self._get_filters_key()
+        variant_key = self._variant_cache_key() if self.cache_variants else None
+        if filters_key is None:
+            return [self._load_batch([instance], self.get_extra_descriptor_filter(instance),
+                                     variant_key)[id(instance)] for instance in instances]
+        # Entries are keyed by a version token per related value. Invalidation
+        # deletes the token, which orphans the entries for all filter values.
+        # Keyed by the database remote saves are signalled with, so that
+        # invalidation finds the entries.
+        keys = [(router.db_for_write(self.remote_field.model, instance=instance),
+                 self.get_local_related_value(instance)) for instance in instances]
+        version_keys = {key: self._shared_cache_key('v', *key) for key in keys}
+        versions = cache.get_many(list(version_keys.values()))
+        new_versions = {}
+        entry_keys = {}
+        for key, version_key in version_keys.items():
+            if version_key not in versions:
+                versions[version_key] = new_versions[version_key] = uuid.uuid4().hex
+            entry_keys[key] = self._shared_cache_key(
+                'e', key[0], key[1], versions[version_key], filters_key)
+        if new_versions:
+            cache.set_many(new_versions, self.cache_timeout)
+        entries = cache.get_many(list(entry_keys.values()))
+        results = {}
+        missing = {}
+        for instance, key in zip(instances, keys):
+            entry = entries.get(entry_keys[key])
+            if entry is not None:
+                rel_obj = entry[0]
+                self.set_cached_value(instance, rel_obj)
+                results[id(instance)] = rel_obj
+            else:
+                missing.setdefault(key[0], []).append(instance)
+        with self._shared_cache_lock:
+            self._shared_cache_hits += len(results)
+            self._shared_cache_misses += len(instances) - len(results)
+        for using, batch in missing.items():
+            loaded = self._load_batch(batch, self.get_extra_descriptor_filter(batch[0]), variant_key)
+            new_entries = {}
+            for instance in batch:
+                rel_obj = loaded[id(instance)]
+                key = (using, self.get_local_related_value(instance))
+                new_entries[entry_keys[key]] = (rel_obj,)
+                if rel_obj is not None:
+                    new_entries[self._shared_cache_key('o', using, rel_obj.pk)] = key[1]
+            cache.set_many(new_entries, self.cache_timeout)
+            results.update(loaded)
+        return [results[id(instance)] for instance in instances]
+
+    def _invalidate_shared_cache(self, using, values):
+        cache = caches[self.cache_alias]
+        cache.delete_many([self._shared_cache_key('v', using, value) for value in values])
+        with self._shared_cache_lock:
+            self._shared_cache_invalidations += 1
+
+    def _invalidate_for_remote(self, sender, instance, using, **kwargs):
+        # A remote object moved to another instance must be removed from the
+        # entries of the previous one, too.
+        previous = caches[self.cache_alias].get(self._shared_cache_key('o', using, instance.pk))
+        values = {self.get_foreign_related_value(instance)}
+        if previous is not None:
+            values.add(previous)
+        self._invalidate_shared_cache(using, values)
+
+    def _invalidate_for_instance(self, sender, instance, using, **kwargs):
+        # The filters may refer to fields of the instance.
+        self._invalidate_shared_cache(using, [self.get_local_related_value(instance)])
+
+    def _get_extra_restriction(self, alias, related_alias):
+        if self.materialize:
+            return None
+        where = self._get_restriction_template()
+        change_map = {
+            self.model._meta.db_table: related_alias,
+            self.remote_field.model._meta.db_table: alias,
+        }
+        return where.relabeled_clone({
+            old: new for old, new in change_map.items() if old != new
+        })
+
     if django.VERSION[0] >= 4:
         get_extra_restriction = _get_extra_restriction
     else:
         def get_extra_restriction(self, where_class, alias, related_alias):
             return self._get_extra_restriction(alias, related_alias)
 
+    def get_cache_name(self):
+        # Django 5.1 replaced get_cache_name() with the cache_name attribute.
+        return self.name
+
+    def _variant_cache_key(self):
+        key = self._get_filters_key()
+        if key is None:
+            return None
+        return (self.get_cache_name(), key)
+
+    def set_cached_value(self, instance, value):
+        super().set_cached_value(instance, value)
+        if self.cache_variants:
+            key = self._variant_cache_key()
+            if key is not None:
+                instance._state.fields_cache[key] = value
+
+    def delete_cached_value(self, instance):
+        super().delete_cached_value(instance)
+        self._clear_cached_variants(instance)
+
+    def clear_cached_values(self, instance):
+        """
+        Forget the cached related objects of instance, if any.
+        """
+        instance._state.fields_cache.pop(self.get_cache_name(), None)
+        self._clear_cached_variants(instance)
+
+    def _clear_cached_variants(self, instance):
+        if self.cache_variants:
+            cache_name = self.get_cache_name()
+            for key in [k for k in instance._state.fields_cache
+                        if isinstance(k, tuple) and k[0] == cache_name]:
+                del instance._state.fields_cache[key]
+
+    def prefetch_variants(self, instances, **variants):
+        """
+        Cache the related object for every combination of the given remote
+        field values on each instance, using a single query. See
+        reverse_unique.query.prefetch_variants().
+        """
+        remote_model = self.remote_field.model
+        variant_fields = [remote_model._meta.get_field(name) for name in variants]
+        get_variant_filters, shared_filters = self._split_variant_filters(variants)
+        instances_by_value = {}
+        for instance in instances:
+            value = self.get_local_related_value(instance)
+            if None not in value:
+                instances_by_value.setdefault(value, []).append(instance)
+        matches = {}
+        if instances_by_value:
+            qs = getattr(self.model, self.name).get_queryset(instance=instances[0])
+            qs = self._filter_related_values(qs, instances_by_value).filter(shared_filters)
+            qs = qs.filter(**{'%s__in' % name: values for name, values in variants.items()})
+            with instrumentation.timer(self, 'query'):
+                qs = list(qs)
+            for rel_obj in qs:
+                variant = tuple(getattr(rel_obj, f.attname) for f in variant_fields)
+                matches[self.get_foreign_related_value(rel_obj), variant] = rel_obj
+        cache_name = self.get_cache_name()
+        for values in product(*variants.values()):
+            key = self._filter_cache_key(get_variant_filters(values))
+            if key is None:
+                continue
+            variant = tuple(getattr(value, 'pk', value) for value in values)
+            for instance in instances:
+                value = self.get_local_related_value(instance)
+                rel_obj = matches.get((value, variant))
+                instance._state.fields_cache[(cache_name, key)] = rel_obj
+
+    def _split_variant_filters(self, variants):
+        """
+        Resolve the filters and return (get_variant_filters, shared_filters).
+        get_variant_filters(values) returns the filters the field resolves to
+        when the conditions on the variant fields have the given values, and
+        shared_filters is a Q object of the other conditions. Raise
+        ValueError if the filters don't consist of conditions combined with
+        AND including an exact condition on each variant field, because the
+        variants couldn't be found by the descriptor then.
+        """
+        filters = None if self.fallback or self.order_by else self.get_filters()
+        if isinstance(filters, dict):
+            children = list(filters.items())
+        elif isinstance(filters, Q) and filters.connector == Q.AND and not filters.negated:
+            children = list(filters.children)
+        else:
+            children = []
+        positions = {
+            child[0]: pos for pos, child in enumerate(children)
+            if isinstance(child, tuple) and child[0] in variants
+        }
+        if len(positions) != len(variants):
+            raise ValueError(
+                "The filters of %s.%s must be conditions combined with AND, including "
+                "an exact condition on each of %s, to prefetch variants."
+                % (self.model._meta.label, self.name, ', '.join(variants)))
+
+        def get_variant_filters(values):
+            variant_children = list(children)
+            for name, value in zip(variants, values):
+                variant_children[positions[name]] = (name, value)
+            if isinstance(filters, dict):
+                return dict(variant_children)
+            return Q(*variant_children)
+
+        shared = [child for pos, child in enumerate(children) if pos not in positions.values()]
+        return get_variant_filters, Q(*shared)
+
+    def _filter_related_values(self, qs, values):
+        if len(self.foreign_related_fields) == 1:
+            return qs.filter(**{'%s__in' % self.foreign_related_fields[0].name:
+                                {value[0] for value in values}})
+        condition = Q()
+        for value in values:
+            condition |= Q(*zip([f.attname for f in self.foreign_related_fields], value))
+        return qs.filter(condition)
+
+    def _load_batch(self, instances, filters, variant_key=None):
+        """
+        Load the related objects of instances with one query, using the given
+        filters (see get_extra_descriptor_filter()), and cache them. If
+        variant_key is given, the objects are cached in that variant slot,
+        too. Return a dict mapping id(instance) to the related object.
+        """
+        values = {self.get_local_related_value(instance) for instance in instances}
+        values = {value for value in values if None not in value}
+        matches = {}
+        if values:
+            if isinstance(filters, dict):
+                filters = Q(**filters)
+            qs = getattr(self.model, self.name).get_queryset(instance=instances[0])
+            qs = self._filter_related_values(qs, values).filter(filters)
+            with instrumentation.timer(self, 'query'):
+                matches = {self.get_foreign_related_value(rel_obj): rel_obj for rel_obj in qs}
+        cache_name = self.get_cache_name()
+        loaded = {}
+        for instance in instances:
+            rel_obj = matches.get(self.get_local_related_value(instance))
+            instance._state.fields_cache[cache_name] = rel_obj
+            if variant_key is not None:
+                instance._state.fields_cache[variant_key] = rel_obj
+            loaded[id(instance)] = rel_obj
+        return loaded
+
+    def get_related_values(self, instances, fields=None, using=None):
+        """
+        Load the related objects of instances with one query, without caching
+        them. Return a dict mapping the local related value of each instance
+        that has a match (see get_local_related_value()) to the remote object,
+        or, if fields is given, to a dict of those fields of the remote object.
+        """
+        values = {self.get_local_related_value(instance) for instance in instances}
+        values = {value for value in values if None not in value}
+        if not values:
+            return {}
+        filters = self.get_extra_descriptor_filter(instances[0])
+        if isinstance(filters, dict):
+            filters = Q(**filters)
+        qs = self.remote_field.model._base_manager.db_manager(using).all()
+        qs = self._filter_related_values(qs, values).filter(filters)
+        with instrumentation.timer(self, 'query'):
+            if fields is None:
+                return {self.get_foreign_related_value(rel_obj): rel_obj for rel_obj in qs}
+            key_names = [f.attname for f in self.foreign_related_fields]
+            fields = list(fields)
+            return {
+                tuple(row[:len(key_names)]): dict(zip(fields, row[len(key_names):]))
+                for row in qs.values_list(*key_names, *fields)
+            }
+
+    def get_correlated_queryset(self):
+        """
+        Return a queryset of the remote model matching the object of the outer
+        query through this field, for use in Exists() and Subquery().
+        """
+        qs = self.remote_field.model._base_manager.filter(**{
+            remote.name: OuterRef(local.name) for local, remote in self.related_fields})
+        if self.materialize:
+            return qs
+        return qs.filter(self.get_filters())
+
     def get_extra_descriptor_filter(self, instance):
+        if self.materialize:
+            return {}
         return self.get_filters()
 
+    @property
+    def materialized_name(self):
+        return '%s_materialized' % self.name
+
+    def refresh_materialized(self, queryset=None):
+        """
+        Store the currently matching remote row in the materialized column
+        for all objects in queryset (default: all objects). Returns the
+        number of rows updated.
+
+        This is done automatically when remote objects are saved or deleted,
+        but needs to be called for example when the filters depend on the
+        current date, or after bulk operations.
+        """
+        if queryset is None:
+            queryset = self.model._base_manager.all()
+        from_fields, to_fields = self._get_join_fields()
+        remote_model = self.remote_field.model
+        match = remote_model._base_manager.filter(**{
+            to_field: OuterRef(from_field) for from_field, to_field in zip(from_fields, to_fields)
+        }).filter(self.get_filters()).values('pk')[:1]
+        return queryset.update(**{self.materialized_name: Subquery(match)})
+
+    def _refresh_for_remote(self, sender, instance, using, **kwargs):
+        # The owners pointing to the remote object may have changed, too,
+        # when it moved to another owner.
+        condition = Q(**{self.materialized_name: instance.pk})
+        values = self.remote_fk.get_local_related_value(instance)
+        if None not in values:
+            from_fields, _ = self._get_join_fields()
+            condition |= Q(**dict(zip(from_fields, values)))
+        self.refresh_materialized(self.model._base_manager.using(using).filter(condition))
+
+    def _refresh_for_instance(self, sender, instance, using, raw=False, **kwargs):
+        if raw or not self._references_owner(self.get_filters()):
+            return
+        queryset = self.model._base_manager.using(using).filter(pk=instance.pk)
+        self.refresh_materialized(queryset)
+        attname = self.model._meta.get_field(self.materialized_name).attname
+        setattr(instance, attname, queryset.values_list(attname, flat=True).get())
+        self.clear_cached_values(instance)
+
+    def _references_owner(self, filters):
+        """
+        Return True if filters refer to fields of the owning model through
+        the remote foreign key, for example F('article__default_lang').
+        """
+        if isinstance(filters, Node):
+            return any(self._references_owner(child) for child in filters.children)
+        if isinstance(filters, dict):
+            filters = list(filters.items())
+        elif isinstance(filters, tuple) and len(filters) == 2:
+            filters = [filters]
+        else:
+            return False
+        prefix = self.remote_fk.name + LOOKUP_SEP
+        for path, value in filters:
+            if path.startswith(prefix):
+                return True
+            expressions = [value]
+            if hasattr(value, 'flatten'):
+                expressions.extend(value.flatten())
+            if any(isinstance(e, F) and e.name.startswith(prefix) for e in expressions):
+                return True
+        return False
+
+    def get_matching_queryset(self, queryset):
+        """
+        Return a queryset of the remote objects matched by the objects in
+        queryset through this field, without loading the objects.
+        """
+        remote_manager = self.remote_field.model._base_manager.db_manager(queryset.db)
+        if self.materialize:
+            return remote_manager.filter(pk__in=queryset.values(self.materialized_name))
+        from_fields, to_fields = self._get_join_fields()
+        if len(to_fields) == 1:
+            qs = remote_manager.filter(**{'%s__in' % to_fields[0]: queryset.values(from_fields[0])})
+        else:
+            qs = remote_manager.filter(Exists(queryset.filter(**{
+                from_field: OuterRef(to_field) for from_field, to_field in zip(from_fields, to_fields)})))
+        return qs.filter(self.get_filters())
+
+    def _after_bulk_write(self, queryset):
+        # Bulk writes don't send signals, keep the materialized column and the
+        # shared cache up to date here.
+        if self.materialize:
+            self.refresh_materialized(queryset)
+        if self.cache_alias is not None:
+            self._invalidate_shared_cache(queryset.db, [
+                self.get_local_related_value(instance) for instance in queryset.only(
+                    *[f.name for f in self.local_related_fields])])
+
+    def update_related(self, queryset, **kwargs):
+        """
+        Update the remote objects matched by the objects in queryset with a
+        single UPDATE query, like queryset.update(). Returns the number of
+        rows updated.
+        """
+        with transaction.atomic(using=queryset.db, savepoint=False):
+            rows = self.get_matching_queryset(queryset).update(**kwargs)
+            self._after_bulk_write(queryset)
+        return rows
+
+    def replace_related(self, pairs):
+        """
+        Replace the matches of several instances at once. pairs is an
+        iterable of (instance, obj), where obj is an unsaved remote object
+        which should match the filters. The current matches are deleted, the
+        foreign keys of the new objects are set to point to their instance,
+        and the new objects are created with bulk_create(). Returns the
+        created objects.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        from_fields, to_fields = self._get_join_fields()
+        local_fields = [self.model._meta.get_field(name) for name in from_fields]
+        remote_fields = [self.remote_field.model._meta.get_field(name) for name in to_fields]
+        for instance, obj in pairs:
+            for local_field, remote_field in zip(local_fields, remote_fields):
+                setattr(obj, remote_field.attname, getattr(instance, local_field.attname))
+        using = router.db_for_write(self.remote_field.model, instance=pairs[0][0])
+        queryset = self.model._base_manager.using(using).filter(
+            pk__in=[instance.pk for instance, obj in pairs])
+        with transaction.atomic(using=using, savepoint=False):
+            self.get_matching_queryset(queryset).delete()
+            objs = self.remote_field.model._base_manager.db_manager(using).bulk_create(
+                [obj for instance, obj in pairs])
+            self._after_bulk_write(queryset)
+        if self.materialize:
+            attname = self.model._meta.get_field(self.materialized_name).attname
+            materialized = dict(queryset.values_list('pk', attname))
+        for instance, obj in pairs:
+            if self.materialize:
+                setattr(instance, attname, materialized.get(instance.pk))
+            self.clear_cached_values(instance)
+        return objs
+
     def get_path_info(self, *args, **kwargs):
         ret = super().get_path_info(*args, **kwargs)
         assert len(ret) == 1
-        return [ret[0]._replace(direct=False)]
+        return [ret[0]._replace(direct=False, join_field=self._shared_join_field)]
 
     def contribute_to_class(self, cls, name):
         super().contribute_to_class(cls, name)
+        # Copies of the field (abstract inheritance) must not share the cache,
+        # the compiled restrictions refer to the table of self.model.
+        self._init_filter_cache()
+        self._init_probe_state()
+        self._init_shared_cache_info()
         setattr(cls, self.name, ReverseUniqueDescriptor(self))
+        setattr(cls, 'aget_%s' % self.name, partialmethod(_aget_reverse_unique, field=self))
+        if not getattr(cls.refresh_from_db, 'clears_reverse_unique_caches', False):
+            cls.refresh_from_db = _clearing_reverse_unique_caches(cls.refresh_from_db)
+        if self.materialize and not cls._meta.abstract:
+            materialized = MaterializedForeignKey(
+                self.remote_field.model, on_delete=models.SET_NULL, null=True,
+                blank=True, editable=False, related_name='+')
+            cls.add_to_class(self.materialized_name, materialized)
+
+    def _filter_lookups(self, filters):
+        """
+        Yield (field, lookup, value) for each condition of filters, where
+        field is a local field of the remote model. Conditions which can't be
+        expressed that way yield None.
+        """
+        if isinstance(filters, Node):
+            for child in filters.children:
+                yield from self._filter_lookups(child)
+            return
+        if not isinstance(filters, tuple) or len(filters) != 2:
+            yield None
+            return
+        path, value = filters
+        parts = path.split(LOOKUP_SEP)
+        try:
+            field = self.remote_field.model._meta.get_field(parts[0])
+        except FieldDoesNotExist:
+            yield None
+            return
+        lookup = LOOKUP_SEP.join(parts[1:]) or 'exact'
+        if len(parts) > 2 or not field.concrete or not field.get_lookup(lookup):
+            yield None
+        else:
+            yield field, lookup, value
+
+    def _is_static_condition(self, filters):
+        if callable(self.filters) or not isinstance(filters, Q):
+            return False
+        for condition in self._filter_lookups(filters):
+            if condition is None or hasattr(condition[2], 'resolve_expression'):
+                return False
+        return True
+
+    def get_remote_index(self):
+        """
+        Return an index on the remote model supporting the joins generated by
+        this field: a conditional UniqueConstraint on the foreign key when the
+        filters are a static Q object, otherwise an Index on the foreign key
+        and the columns used in the filters (and in order_by). Returns None
+        for fallback and materialized fields.
+        """
+        if self.fallback or self.materialize:
+            return None
+        remote_opts = self.remote_field.model._meta
+        fk_names = [f.name for f in self.remote_fk.local_related_fields]
+        name = '%s_%s_ru' % (remote_opts.db_table[:11],
+                             names_digest(self.model._meta.label_lower, self.name, length=8))
+        filters = self._get_base_filters()
+        if not self.order_by and self._is_static_condition(filters):
+            return models.UniqueConstraint(fields=fk_names, condition=filters, name=name)
+        columns = list(fk_names)
+        for condition in self._filter_lookups(filters):
+            if condition is not None and condition[0].name not in columns:
+                columns.append(condition[0].name)
+        for order in self.order_by:
+            if order.lstrip('-') not in columns and order.lstrip('-') != 'pk':
+                columns.append(order)
+        return models.Index(fields=columns, name=name)
+
+    def add_remote_index(self):
+        """
+        Add the index returned by get_remote_index() to the remote model's
+        options, so that it is created by migrate and makemigrations. Called
+        when the app registry is ready, foreign keys can't be resolved
+        reliably before that.
+        """
+        index = self.get_remote_index()
+        if index is None:
+            return
+        opts = self.remote_field.model._meta
+        if any(i.name == index.name for i in [*opts.indexes, *opts.constraints]):
+            return
+        # Assign new lists, the old ones might be shared through Meta
+        # inheritance. Options in original_attrs end up in migrations.
+        if isinstance(index, models.Index):
+            opts.indexes = opts.original_attrs['indexes'] = [*opts.indexes, index]
+        else:
+            opts.constraints = opts.original_attrs['constraints'] = [*opts.constraints, index]
+
+    def contribute_to_related_class(self, cls, related):
+        super().contribute_to_related_class(cls, related)
+        if self.materialize and not self.model._meta.abstract:
+            uid = 'reverse_unique.%s.%s' % (self.model._meta.label_lower, self.name)
+            signals.post_save.connect(
+                self._refresh_for_remote, sender=cls, weak=False, dispatch_uid=uid)
+            signals.post_delete.connect(
+                self._refresh_for_remote, sender=cls, weak=False, dispatch_uid=uid)
+            # Filters referring to the owner change when the owner is saved.
+            signals.post_save.connect(
+                self._refresh_for_instance, sender=self.model, weak=False, dispatch_uid=uid + '.instance')
+        if self.cache_alias is not None and not self.model._meta.abstract:
+            uid = 'reverse_unique.cache.%s.%s' % (self.model._meta.label_lower, self.name)
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(self._invalidate_for_remote, sender=cls, weak=False, dispatch_uid=uid)
+                signal.connect(self._invalidate_for_instance, sender=self.model, weak=False,
+                               dispatch_uid=uid + '.instance')
 
     def deconstruct(self):
         name, path, args, kwargs = super().deconstruct()
-        kwargs['filters'] = self.filters
+        if self.fallback:
+            kwargs['fallback'] = self.fallback
+        else:
+            kwargs['filters'] = self.filters
         if self.through is not None:
             kwargs['through'] = self.through
+        if self.order_by:
+            kwargs['order_by'] = self.order_by
+        if self.cache_variants:
+            kwargs['cache_variants'] = True
+        if self.materialize:
+            kwargs['materialize'] = True
+        if self.remote_index:
+            kwargs['remote_index'] = True
+        if self.probe_rate:
+            kwargs['probe_rate'] = self.probe_rate
+        if self.probe_interval != 60:
+            kwargs['probe_interval'] = self.probe_interval
+        if self.cache_alias is not None:
+            kwargs['cache'] = self.cache_alias
+        if self.cache_timeout is not DEFAULT_TIMEOUT:
+            kwargs['cache_timeout'] = self.cache_timeout
+        if self.auto_select:
+            kwargs['auto_select'] = True
+        if self.auto_select_fields is not None:
+            kwargs['auto_select_fields'] = self.auto_select_fields
         return name, path, args, kwargs
+
+    def get_auto_select_immediate(self):
+        """
+        Return the lookups to load when the field is selected automatically:
+        the relation itself and its primary key and auto_select_fields, or
+        the whole relation if auto_select_fields isn't set.
+        """
+        if self.auto_select_fields is None:
+            return [self.name]
+        return [self.name] + [
+            '%s%s%s' % (self.name, LOOKUP_SEP, f.name)
+            for f in self.remote_field.model._meta.concrete_fields
+            if f.primary_key or f.name in self.auto_select_fields
+        ]
@@ -0,0 +1,127 @@
+"""
+Per-field counters and timers for ReverseUnique.
+
+The fields report events to the active collector:
+
+- restriction_build: a join restriction was compiled (timed)
+- cache_hit, cache_miss: descriptor access found, or didn't find, a cached value
+- query: the field issued a query to load related objects (timed)
+- none_result: descriptor access returned None
+
+The default collector ignores the events, and the fields skip the timing
+when the collector isn't enabled.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from .signals import field_event
+
+EVENTS = ('restriction_build', 'cache_hit', 'cache_miss', 'query', 'none_result')
+
+
+class Collector:
+    """
+    Base class for collectors. Subclasses set enabled = True and implement
+    record().
+    """
+    enabled = False
+
+    def record(self, field, event, duration=None):
+        pass
+
+
+class StatsCollector(Collector):
+    """
+    Aggregates events in process, per field (keyed by 'app_label.Model.field').
+    """
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = defaultdict(Counter)
+            self.durations = defaultdict(Counter)
+
+    def record(self, field, event, duration=None):
+        key = '%s.%s' % (field.model._meta.label, field.name)
+        with self._lock:
+            self.counts[key][event] += 1
+            if duration is not None:
+                self.durations[key][event] += duration
+
+    def get(self, key, event):
+        return self.counts[key][event]
+
+    def total(self, event):
+        return sum(counts[event] for counts in self.counts.values())
+
+
+class SignalCollector(Collector):
+    """
+    Sends every event with the reverse_unique.signals.field_event signal.
+    """
+    enabled = True
+
+    def record(self, field, event, duration=None):
+        field_event.send(sender=field.model, field=field, event=event, duration=duration)
+
+
+collector = Collector()
+
+
+def get_collector():
+    return collector
+
+
+def set_collector(new_collector):
+    """
+    Install new_collector (None installs the no-op default), and return the
+    previous one.
+    """
+    global collector
+    previous = collector
+    collector = new_collector if new_collector is not None else Collector()
+    return previous
+
+
+@contextmanager
+def collect_stats():
+    """
+    Collect events into a new StatsCollector for the duration of the block,
+    for example in tests:
+
+        with collect_stats() as stats:
+            article.active_translation
+        assert stats.total('query') == 1
+    """
+    stats = StatsCollector()
+    previous = set_collector(stats)
+    try:
+        yield stats
+    finally:
+        set_collector(previous)
+
+
+class timer:
+    """
+    Time a block and record event if the collector is enabled.
+    """
+    __slots__ = ('field', 'event', 'collector', 'start')
+
+    def __init__(self, field, event):
+        self.field = field
+        self.event = event
+        self.collector = collector
+
+    def __enter__(self):
+        if self.collector.enabled:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.collector.enabled:
+            self.collector.record(self.field, self.event, time.perf_counter() - self.start)
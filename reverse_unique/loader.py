@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from threading import Lock
+from weakref import WeakValueDictionary
+
+from asgiref.sync import sync_to_async
+from django.db.models import signals
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python 3.6. The active loader is tracked per thread, so concurrent
+    # coroutines in one thread share it.
+    class ContextVar(threading.local):
+        def __init__(self, name, default=None):
+            self.name = name
+            self.value = default
+
+        def get(self):
+            return self.value
+
+        def set(self, value):
+            token, self.value = self.value, value
+            return token
+
+        def reset(self, token):
+            self.value = token
+
+_current_loader = ContextVar('reverse_unique_loader', default=None)
+_receivers_lock = Lock()
+_receivers = 0
+
+
+def get_loader():
+    """
+    Return the ReverseUniqueLoader active in the current context, or None.
+    """
+    return _current_loader.get()
+
+
+def _register_instance(sender, instance, **kwargs):
+    loader = _current_loader.get()
+    if loader is not None:
+        loader.register(instance)
+
+
+def _connect_receivers():
+    global _receivers
+    with _receivers_lock:
+        if not _receivers:
+            signals.post_init.connect(_register_instance, dispatch_uid='reverse_unique.loader')
+        _receivers += 1
+
+
+def _disconnect_receivers():
+    global _receivers
+    with _receivers_lock:
+        _receivers -= 1
+        if not _receivers:
+            signals.post_init.disconnect(dispatch_uid='reverse_unique.loader')
+
+
+class ReverseUniqueLoader:
+    """
+    Batches the loads of ReverseUnique fields.
+
+    In sync code, the loader remembers the model instances created while it
+    is active (or passed to register()), as long as they are referenced
+    elsewhere. When a ReverseUnique field is
+    accessed on one of them and isn't cached, the field is loaded for all
+    remembered instances which don't have it cached for the filter value in
+    effect, using one query.
+
+    In async code, loads awaited through aload() (or aget_<name>()) in the
+    same event loop iteration are collected and resolved together for each
+    field, filter value and database.
+    """
+    def __init__(self):
+        self._instances = {}
+        self._models = {}
+        self._batches = {}
+
+    def _has_reverse_unique(self, model):
+        try:
+            return self._models[model]
+        except KeyError:
+            has_fields = any(hasattr(f, 'remote_fk') for f in model._meta.local_fields)
+            return self._models.setdefault(model, has_fields)
+
+    def register(self, *instances):
+        for instance in instances:
+            if self._has_reverse_unique(type(instance)):
+                model_instances = self._instances.get(type(instance))
+                if model_instances is None:
+                    model_instances = self._instances[type(instance)] = WeakValueDictionary()
+                model_instances[id(instance)] = instance
+
+    def _variant_key(self, field):
+        return field._variant_cache_key() if field.cache_variants else None
+
+    def load(self, field, instance):
+        """
+        Load field for instance and the other registered instances missing
+        it, return the related object of instance.
+        """
+        descriptor = getattr(field.model, field.name)
+        using = instance._state.db
+        batch = [instance]
+        for model, instances in self._instances.items():
+            if not issubclass(model, field.model):
+                continue
+            batch.extend(
+                obj for obj in list(instances.values())
+                if obj is not instance and obj._state.db == using and not descriptor.is_cached(obj)
+            )
+        loaded = field._load_batch(batch, field.get_extra_descriptor_filter(instance),
+                                   self._variant_key(field))
+        return loaded[id(instance)]
+
+    async def aload(self, field, instance):
+        """
+        Load field for instance, batched with the other loads of the same
+        field and filter value awaited in this event loop iteration.
+        """
+        filters_key = field._get_filters_key()
+        if filters_key is None:
+            # Filters which can't be compared can't be batched either.
+            loaded = await sync_to_async(field._load_batch)(
+                [instance], field.get_extra_descriptor_filter(instance))
+            return loaded[id(instance)]
+        key = (field, self._variant_key(field), filters_key, instance._state.db)
+        batch = self._batches.get(key)
+        if batch is None:
+            # get_event_loop() returns the running loop in a coroutine, and
+            # unlike get_running_loop() exists on Python 3.6.
+            loop = asyncio.get_event_loop()
+            batch = self._batches[key] = {
+                'filters': field.get_extra_descriptor_filter(instance),
+                'instances': [],
+                'future': loop.create_future(),
+            }
+            # The task runs after the coroutines ready in this iteration of
+            # the event loop had the chance to add their instances.
+            batch['task'] = loop.create_task(self._dispatch(key))
+        batch['instances'].append(instance)
+        loaded = await asyncio.shield(batch['future'])
+        return loaded[id(instance)]
+
+    async def _dispatch(self, key):
+        field, variant_key = key[:2]
+        batch = self._batches.pop(key)
+        try:
+            loaded = await sync_to_async(field._load_batch)(
+                batch['instances'], batch['filters'], variant_key)
+        except Exception as e:
+            batch['future'].set_exception(e)
+        else:
+            batch['future'].set_result(loaded)
+
+
+@contextmanager
+def batch_loading():
+    """
+    Activate a ReverseUniqueLoader for the block, for example for the duration
+    of a request.
+    """
+    loader = ReverseUniqueLoader()
+    token = _current_loader.set(loader)
+    _connect_receivers()
+    try:
+        yield loader
+    finally:
+        _disconnect_receivers()
+        _current_loader.reset(token)
+
+
+class BatchLoadingMiddleware:
+    """
+    Batch the ReverseUnique loads of each request, see batch_loading().
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with batch_loading():
+            return self.get_response(request)
@@ -0,0 +1,44 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from reverse_unique.checks import check_field, get_reverse_unique_fields
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the joins generated by ReverseUnique fields are backed by "
+        "indexes and unique constraints, and that the database doesn't scan "
+        "the remote tables sequentially."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'args', metavar='app_label', nargs='*',
+            help='Only check the fields of the models in these apps.',
+        )
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='The database to run EXPLAIN against. Defaults to the "default" database.',
+        )
+        parser.add_argument(
+            '--no-explain', action='store_false', dest='explain',
+            help="Don't inspect query plans, only the model definitions.",
+        )
+
+    def handle(self, *app_labels, **options):
+        try:
+            app_configs = [apps.get_app_config(label) for label in app_labels] or None
+        except LookupError as e:
+            raise CommandError("%s. Are you sure your INSTALLED_APPS setting is correct?" % e)
+        using = options['database'] if options['explain'] else None
+        messages = []
+        for field in get_reverse_unique_fields(app_configs):
+            messages.extend(check_field(field, using))
+        for message in messages:
+            self.stdout.write(str(message))
+            if message.hint and options['verbosity'] > 1:
+                self.stdout.write('\tHINT: %s' % message.hint)
+        if messages:
+            raise CommandError('%d problem(s) found in ReverseUnique fields.' % len(messages))
+        self.stdout.write('No problems found in ReverseUnique fields.')
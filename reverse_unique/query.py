@@ -0,0 +1,200 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+
+
+def prefetch_variants(instances, lookup, **variants):
+    """
+    Load several filter variants of the ReverseUnique field named by lookup
+    for all instances in one query.
+
+    The keyword arguments map remote model field names to lists of values,
+    for example lang=['fi', 'en']. Each combination of values is a variant,
+    and it is cached for the filter value Q(**combination). This matches the
+    field's filters when they resolve to exactly that Q object, for example
+    Q(lang=get_language()). The field must be defined with
+    cache_variants=True.
+    """
+    instances = list(instances)
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(lookup)
+    if not getattr(field, 'cache_variants', False):
+        raise ValueError(
+            "prefetch_variants() requires a ReverseUnique field with "
+            "cache_variants=True, got %s.%s." % (instances[0]._meta.label, lookup))
+    field.prefetch_variants(instances, **variants)
+
+
+async def aprefetch_variants(instances, lookup, **variants):
+    """
+    Async version of prefetch_variants().
+    """
+    await sync_to_async(prefetch_variants)(list(instances), lookup, **variants)
+
+
+def iter_with_reverse_unique(queryset, lookup, fields=None, chunk_size=2000):
+    """
+    Iterate over queryset using iterator(), yielding (obj, match) pairs where
+    match is the object the ReverseUnique field named by lookup matches, or
+    None. The matches are loaded with one query per chunk_size objects, so
+    memory use doesn't grow with the size of the result.
+
+    If fields is given, match is a dict of those fields of the remote object
+    (values() style, for example fields=['from_date', 'guest__name']) instead
+    of a model instance. Otherwise the matches are also cached on the objects.
+    """
+    field = queryset.model._meta.get_field(lookup)
+    if not hasattr(field, 'get_related_values'):
+        raise ValueError(
+            "iter_with_reverse_unique() requires a ReverseUnique field, got %s.%s."
+            % (queryset.model._meta.label, lookup))
+    objs = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(objs, chunk_size))
+        if not chunk:
+            return
+        matches = field.get_related_values(chunk, fields, using=queryset.db)
+        for obj in chunk:
+            match = matches.get(field.get_local_related_value(obj))
+            if fields is None:
+                field.set_cached_value(obj, match)
+            yield obj, match
+
+
+class ReverseUniqueQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prefetch_variant_lookups = ()
+        self._prefetch_variants_done = False
+        self._auto_select = True
+
+    def prefetch_variants(self, lookup, **variants):
+        """
+        Return a new QuerySet that loads the given variants of a ReverseUnique
+        field when evaluated, see prefetch_variants().
+        """
+        clone = self._chain()
+        clone._prefetch_variant_lookups += ((lookup, variants),)
+        return clone
+
+    def without_auto_select(self):
+        """
+        Return a new QuerySet that doesn't select the ReverseUnique fields
+        defined with auto_select=True unless asked to with select_related().
+        """
+        clone = self._chain()
+        clone._auto_select = False
+        return clone
+
+    def _get_auto_select_query(self):
+        """
+        Return a copy of the query which also selects the auto_select fields,
+        or None if there's nothing to add.
+        """
+        query = self.query
+        if (not self._auto_select or not issubclass(self._iterable_class, ModelIterable)
+                or query.combinator or query.select_related is True):
+            return None
+        if query.select_for_update:
+            # FOR UPDATE can't be applied to the nullable side of an outer join
+            # on some databases.
+            return None
+        deferred_names, defer = query.deferred_loading
+        if not defer:
+            # Fields not named in only() can't be traversed.
+            return None
+        selected = query.select_related or {}
+        fields = [
+            f for f in self.model._meta.get_fields()
+            if getattr(f, 'auto_select', False) and f.name not in selected and f.name not in deferred_names
+        ]
+        if not fields:
+            return None
+        query = query.chain()
+        query.add_select_related([f.name for f in fields])
+        restricted = [f for f in fields if f.auto_select_fields is not None]
+        if restricted and not selected and not any(LOOKUP_SEP in name for name in deferred_names):
+            # Django 4.2+ rejects deferring fields of a select_related
+            # relation, so load an only()-style mask which names the
+            # relations instead.
+            immediate = [
+                f.name for f in self.model._meta.concrete_fields
+                if f.name not in deferred_names and f.attname not in deferred_names
+            ]
+            for f in fields:
+                immediate.extend(f.get_auto_select_immediate())
+            query.clear_deferred_loading()
+            query.add_immediate_loading(immediate)
+        return query
+
+    def _with_auto_select(self):
+        """
+        Return a clone which selects the auto_select fields, or self if there
+        is nothing to add. The query of self is never changed, so that
+        querysets chained from it don't inherit the extra selections.
+        """
+        query = self._get_auto_select_query()
+        if query is None:
+            return self
+        clone = self._chain()
+        clone.query = query
+        return clone
+
+    def iter_with_reverse_unique(self, lookup, fields=None, chunk_size=2000):
+        """
+        Iterate over (obj, match) pairs, see iter_with_reverse_unique().
+        """
+        return iter_with_reverse_unique(self, lookup, fields, chunk_size)
+
+    def refresh_materialized(self, *field_names):
+        """
+        Recompute the materialized columns of the given ReverseUnique fields
+        (default: all materialized fields) for the objects in this QuerySet.
+        """
+        if not field_names:
+            field_names = [f.name for f in self.model._meta.get_fields()
+                           if getattr(f, 'materialize', False)]
+        for name in field_names:
+            self.model._meta.get_field(name).refresh_materialized(self)
+
+    def update_related(self, field_name, **kwargs):
+        """
+        Update the remote objects the ReverseUnique field field_name matches
+        for the objects in this QuerySet, using a single UPDATE query:
+
+            Employee.objects.filter(...).update_related('current_salary', salary=F('salary') * 2)
+        """
+        return self.model._meta.get_field(field_name).update_related(self, **kwargs)
+
+    def _clone(self):
+        c = super()._clone()
+        c._prefetch_variant_lookups = self._prefetch_variant_lookups
+        c._auto_select = self._auto_select
+        return c
+
+    def _iterator(self, *args, **kwargs):
+        queryset = self._with_auto_select()
+        return super(ReverseUniqueQuerySet, queryset)._iterator(*args, **kwargs)
+
+    def _fetch_all(self):
+        if self._result_cache is not None:
+            super()._fetch_all()
+        else:
+            queryset = self._with_auto_select()
+            if queryset is not self:
+                self._result_cache = list(self._iterable_class(queryset))
+            super()._fetch_all()
+            if isinstance(queryset.query.select_related, dict):
+                for name in queryset.query.select_related:
+                    field = self.model._meta.get_field(name)
+                    if hasattr(field, 'maybe_probe'):
+                        field.maybe_probe(self.db)
+        if (self._prefetch_variant_lookups and not self._prefetch_variants_done
+                and issubclass(self._iterable_class, ModelIterable)):
+            for lookup, variants in self._prefetch_variant_lookups:
+                prefetch_variants(self._result_cache, lookup, **variants)
+            self._prefetch_variants_done = True
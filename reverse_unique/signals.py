@@ -0,0 +1,12 @@
+from django.dispatch import Signal
+
+# Sent when a sampling probe finds remote rows matching a ReverseUnique field's
+# filters more than once for the same object. Arguments: sender (the model of
+# the field), field, values (the duplicated foreign key values) and using.
+duplicate_match = Signal()
+
+# Sent for every event reported by a ReverseUnique field while
+# reverse_unique.instrumentation.SignalCollector is installed. Arguments:
+# sender (the model of the field), field, event and duration (in seconds, or
+# None for events which aren't timed).
+field_event = Signal()
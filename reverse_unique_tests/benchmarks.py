@@ -0,0 +1,261 @@
+"""
+Benchmarks for ReverseUnique on SQLite.
+
+Seeds the test models with the given number of rows and measures SQL
+compilation, descriptor access, iteration and memory use. Run from the
+repository root:
+
+    python -m reverse_unique_tests.benchmarks --rows 1000 100000
+    python -m reverse_unique_tests.benchmarks --save reverse_unique_tests/benchmark_baseline.json
+    python -m reverse_unique_tests.benchmarks --compare reverse_unique_tests/benchmark_baseline.json
+
+Times are relative to the reference operation, compiling a query without
+ReverseUnique fields, which is timed between the repeats of each
+benchmark so that the speed and load of the machine cancel out. The
+reference itself is reported in seconds, memory in bytes per loaded
+instance. With --compare, results more than --threshold (default 25%)
+slower than the baseline are reported and the exit status is 1.
+"""
+import argparse
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+import django
+
+BATCH_SIZE = 10000
+# How many objects the iteration and memory benchmarks load.
+ITERATION_SIZE = 1000
+REPEAT = 10
+REFERENCE_NUMBER = 200
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reverse_unique_tests.settings')
+    django.setup()
+    from django.utils.translation import activate
+    activate('fi')
+
+
+def seed(rows):
+    from django.db import connection
+    from reverse_unique_tests.models import (
+        AnotherChild, Article, ArticleTranslation, Child, Guest, Lang, Parent, Rel1,
+        Rel2, Reservation, Room)
+
+    today = datetime.date.today()
+    ids = range(1, rows + 1)
+
+    def bulk_create(model, objs):
+        model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+    Lang.objects.bulk_create([Lang(code='fi'), Lang(code='en')])
+    bulk_create(Article, (Article(pk=i, pub_date=today) for i in ids))
+    bulk_create(ArticleTranslation, (
+        ArticleTranslation(article_id=i, lang_id=lang, title='title %s' % i, body='body')
+        for i in ids for lang in ('fi', 'en')))
+
+    guest = Guest.objects.create(name='guest')
+    bulk_create(Room, (Room(pk=i) for i in ids))
+    bulk_create(Reservation, (
+        Reservation(room_id=i, guest=guest, from_date=from_date, until_date=until_date)
+        for i in ids
+        for from_date, until_date in [
+            (today - datetime.timedelta(days=10), today - datetime.timedelta(days=5)),
+            (today - datetime.timedelta(days=1), None)]))
+
+    # bulk_create() doesn't support multi-table inheritance, so the child
+    # tables are filled directly.
+    bulk_create(Parent, (Parent(pk=i) for i in ids))
+    with connection.cursor() as cursor:
+        for model in (Child, AnotherChild):
+            opts = model._meta
+            cursor.executemany(
+                'INSERT INTO %s (%s) VALUES (%%s)' % (
+                    connection.ops.quote_name(opts.db_table),
+                    connection.ops.quote_name(opts.pk.column)),
+                [(i,) for i in ids])
+    bulk_create(Rel1, (Rel1(parent_id=i, f1='foo') for i in ids))
+    bulk_create(Rel2, (Rel2(child_id=i, f1='foo') for i in ids))
+
+
+@functools.lru_cache()
+def get_reference():
+    """
+    Return the reference operation, compiling a query without ReverseUnique
+    fields.
+    """
+    from django.db import DEFAULT_DB_ALIAS
+    from reverse_unique_tests.models import Article
+
+    today = datetime.date.today()
+    return lambda: Article.objects.filter(pub_date=today).query.get_compiler(DEFAULT_DB_ALIAS).as_sql()
+
+
+def best_of(func, number):
+    """
+    Return the time of func relative to the reference operation, the best
+    of REPEAT interleaved runs of both.
+    """
+    reference = get_reference()
+    times = []
+    reference_times = []
+    for _ in range(REPEAT):
+        reference_times.append(timeit.timeit(reference, number=REFERENCE_NUMBER) / REFERENCE_NUMBER)
+        times.append(timeit.timeit(func, number=number) / number)
+    return min(times) / min(reference_times)
+
+
+def bench_reference():
+    times = timeit.repeat(get_reference(), repeat=REPEAT, number=REFERENCE_NUMBER)
+    return {'reference': min(times) / REFERENCE_NUMBER}
+
+
+def bench_compile():
+    from django.db import DEFAULT_DB_ALIAS
+    from reverse_unique_tests.models import AnotherChild, Article, Room
+
+    querysets = {
+        'compile_filter': lambda: Article.objects.filter(active_translation__title='x'),
+        'compile_order_by': lambda: Article.objects.order_by('active_translation__title'),
+        'compile_select_related': lambda: Article.objects.select_related('active_translation'),
+        'compile_callable_filters': lambda: Room.objects.filter(
+            current_reservation__guest__name='x'),
+        'compile_inherited': lambda: AnotherChild.objects.select_related('rel1_child', 'rel2'),
+    }
+    results = {}
+    for name, make_qs in querysets.items():
+        results[name] = best_of(
+            lambda: make_qs().query.get_compiler(DEFAULT_DB_ALIAS).as_sql(), number=200)
+    return results
+
+
+def bench_descriptor():
+    from reverse_unique_tests.models import Article
+
+    field = Article._meta.get_field('active_translation')
+    article = Article.objects.first()
+    article.active_translation
+
+    def miss():
+        field.delete_cached_value(article)
+        article.active_translation
+
+    return {
+        'descriptor_hit': best_of(lambda: article.active_translation, number=10000),
+        'descriptor_miss': best_of(miss, number=200),
+    }
+
+
+def bench_iteration(rows):
+    from reverse_unique_tests.models import AnotherChild, Article
+
+    size = min(rows, ITERATION_SIZE)
+
+    def iterate(qs):
+        for article in qs[:size]:
+            article.active_translation
+
+    return {
+        'iterate_without_select_related': best_of(
+            lambda: iterate(Article.objects.all()), number=1),
+        'iterate_with_select_related': best_of(
+            lambda: iterate(Article.objects.select_related('active_translation')), number=1),
+        'join_filter_count': best_of(
+            lambda: Article.objects.filter(active_translation__title__endswith='1').count(),
+            number=1),
+        'join_inherited_count': best_of(
+            lambda: AnotherChild.objects.filter(rel1_child__isnull=False).count(), number=1),
+    }
+
+
+def bench_memory(rows):
+    from reverse_unique_tests.models import Article
+
+    size = min(rows, ITERATION_SIZE)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        articles = list(Article.objects.select_related('active_translation')[:size])
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return {'memory_per_instance': (after - before) / len(articles)}
+
+
+def run(rows):
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        seed(rows)
+        results = bench_reference()
+        results.update(bench_compile())
+        results.update(bench_descriptor())
+        results.update(bench_iteration(rows))
+        results.update(bench_memory(rows))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print results against baseline and return the number of regressions.
+    """
+    regressions = 0
+    for rows, measurements in results.items():
+        for name, value in measurements.items():
+            old = baseline.get(rows, {}).get(name)
+            if not old or name == 'reference':
+                print('%8s %-32s %12.6g       (%s)' % (rows, name, value, 'reference' if old else 'new'))
+                continue
+            ratio = value / old
+            regressed = ratio > 1 + threshold
+            regressions += regressed
+            print('%8s %-32s %12.6g %+6.0f%%%s' % (
+                rows, name, value, (ratio - 1) * 100, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000],
+                        help='The numbers of rows to seed, for example 1000 100000 1000000.')
+    parser.add_argument('--save', metavar='FILE', help='Write the results to FILE as a baseline.')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results to the baseline in FILE.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='The slowdown reported as a regression (default: 0.25).')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = {str(rows): run(rows) for rows in args.rows}
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    if not __package__:
+        # Run as a script, make the test package importable.
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.exit(main())
@@ -3,7 +3,7 @@ from datetime import date
 from django.db import models
 from django.db.models import Q, F
 from django.utils.translation import get_language
-from reverse_unique import ReverseUnique
+from reverse_unique import ReverseUnique, ReverseUniqueQuerySet
 
 
 def filter_lang():
@@ -14,6 +14,12 @@ class Article(models.Model):
     pub_date = models.DateField()
     active_translation = ReverseUnique(
         "ArticleTranslation", filters=filter_lang)
+    translation = ReverseUnique(
+        "ArticleTranslation", filters=filter_lang, cache_variants=True)
+    cached_translation = ReverseUnique(
+        "ArticleTranslation", filters=filter_lang, cache=True)
+
+    objects = ReverseUniqueQuerySet.as_manager()
 
     class Meta:
         app_label = 'reverse_unique'
@@ -38,6 +44,27 @@ class ArticleTranslation(models.Model):
         app_label = 'reverse_unique'
 
 
+class Book(models.Model):
+    translation = ReverseUnique(
+        "BookTranslation", filters=filter_lang, auto_select=True, auto_select_fields=('title',))
+
+    objects = ReverseUniqueQuerySet.as_manager()
+
+    class Meta:
+        app_label = 'reverse_unique'
+
+
+class BookTranslation(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    lang = models.CharField(max_length=2)
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    class Meta:
+        unique_together = ('book', 'lang')
+        app_label = 'reverse_unique'
+
+
 # The idea for DefaultTranslationArticle is that article's have default
 # language. This allows testing of filter condition targeting both
 # tables in the join.
@@ -48,6 +75,12 @@ class DefaultTranslationArticle(models.Model):
         "DefaultTranslationArticleTranslation", filters=filter_lang)
     default_translation = ReverseUnique(
         "DefaultTranslationArticleTranslation", filters=Q(lang=F('article__default_lang')))
+    translation = ReverseUnique(
+        "DefaultTranslationArticleTranslation",
+        fallback=('active_translation', 'default_translation'))
+    stored_default_translation = ReverseUnique(
+        "DefaultTranslationArticleTranslation", filters=Q(lang=F('article__default_lang')),
+        materialize=True)
 
     class Meta:
         app_label = 'reverse_unique'
@@ -80,7 +113,12 @@ def filter_reservations():
 class Room(models.Model):
     current_reservation = ReverseUnique(
         "Reservation", through='reservations',
-        filters=filter_reservations)
+        filters=filter_reservations, remote_index=True)
+    latest_reservation = ReverseUnique(
+        "Reservation", through='reservations', order_by=('-from_date',))
+    last_finished_reservation = ReverseUnique(
+        "Reservation", through='reservations', filters=Q(until_date__isnull=False),
+        order_by=('-until_date', '-pk'))
 
     class Meta:
         app_label = 'reverse_unique'
@@ -97,7 +135,7 @@ class Reservation(models.Model):
 
 
 class Parent(models.Model):
-    rel1 = ReverseUnique("Rel1", filters=Q(f1="foo"))
+    rel1 = ReverseUnique("Rel1", filters=Q(f1="foo"), remote_index=True)
     uniq_field = models.CharField(max_length=10, unique=True, null=True)
 
     class Meta:
@@ -139,3 +177,60 @@ class Rel3(models.Model):
 
     class Meta:
         app_label = 'reverse_unique'
+
+
+def filter_salaries():
+    return Q(valid_from__lte=date.today()) & (
+        Q(valid_until__gte=date.today()) | Q(valid_until__isnull=True))
+
+
+class Employee(models.Model):
+    name = models.CharField(max_length=100)
+    current_salary = ReverseUnique(
+        "EmployeeSalary", filters=filter_salaries, materialize=True)
+
+    objects = ReverseUniqueQuerySet.as_manager()
+
+    class Meta:
+        app_label = 'reverse_unique'
+
+
+class EmployeeSalary(models.Model):
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='salaries')
+    salary = models.IntegerField()
+    valid_from = models.DateField()
+    valid_until = models.DateField(null=True)
+
+    class Meta:
+        app_label = 'reverse_unique'
+
+
+class TenantParent(models.Model):
+    tenant_id = models.IntegerField()
+    main_item = ReverseUnique("TenantItem", filters=Q(kind='main'))
+
+    class Meta:
+        unique_together = ('tenant_id', 'id')
+        app_label = 'reverse_unique'
+
+
+class TenantChild(TenantParent):
+    # A copy of the parent's tenant_id, so that joins on the composite key
+    # don't need the parent table.
+    child_tenant_id = models.IntegerField(db_column='tenant_id')
+    child_main_item = ReverseUnique("TenantItem", filters=Q(kind='main'))
+
+    class Meta:
+        app_label = 'reverse_unique'
+
+
+class TenantItem(models.Model):
+    tenant_id = models.IntegerField()
+    owner_id = models.IntegerField()
+    owner = models.ForeignObject(
+        TenantParent, on_delete=models.CASCADE, from_fields=['tenant_id', 'owner_id'],
+        to_fields=['tenant_id', 'id'], related_name='items')
+    kind = models.CharField(max_length=10)
+
+    class Meta:
+        app_label = 'reverse_unique'
@@ -17,4 +17,7 @@ INSTALLED_APPS = [
     'reverse_unique_tests',
 ]
 
-DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# The test models deliberately include joins the performance checks warn about.
+SILENCED_SYSTEM_CHECKS = ['reverse_unique.W001', 'reverse_unique.W002', 'reverse_unique.W003']
@@ -1,16 +1,34 @@
+import asyncio
 import datetime
+import gc
+from io import StringIO
+from unittest import mock, skipUnless
 
+import django
 from django import forms
-from django.db import models
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Prefetch, Q
 from django.test import TestCase
-from django.utils.translation import activate
+from django.test.utils import CaptureQueriesContext, isolate_apps
+from django.utils.translation import activate, get_language
 
-from reverse_unique import ReverseUnique
+from reverse_unique import (
+    ReverseUnique, ReverseUniqueExists, ReverseUniqueSubquery, aprefetch_variants, iter_with_reverse_unique,
+    prefetch_variants)
+from reverse_unique.checks import check_field, check_query_plan
+from reverse_unique.evaluator import CannotEvaluate, FilterEvaluator
+from reverse_unique.instrumentation import SignalCollector, collect_stats, get_collector, set_collector
+from reverse_unique.loader import batch_loading
+from reverse_unique.signals import duplicate_match, field_event
 
 from .models import (
-    Article, ArticleTranslation, Lang, DefaultTranslationArticle,
+    Article, ArticleTranslation, Book, BookTranslation, Lang, DefaultTranslationArticle,
     DefaultTranslationArticleTranslation, Guest, Room, Reservation,
-    Parent, Child, AnotherChild, Rel1, Rel2)
+    Parent, Child, AnotherChild, Rel1, Rel2, Rel3, Employee, EmployeeSalary, TenantParent,
+    TenantChild, TenantItem)
 
 
 class ReverseUniqueTests(TestCase):
@@ -221,8 +239,8 @@ class InheritanceTests(TestCase):
                 'The field(s) uniq_field of model reverse_unique.Parent which '
                 'reverse_unique.Rel3.a_model is pointing to cannot be found from '
                 'reverse_unique.FailingChild. Add ReverseUnique to parent instead.'):
-            # Unfortunately we get the error only at first query, not at
-            # model definition time.
+            # The error is reported by the system checks, too, see
+            # WarmUpTests.
             FailingChild.objects.filter(rev_uniq__pk__contains=1)
 
         class FailingChild2(Parent):
@@ -251,3 +269,1259 @@ class InheritanceTests(TestCase):
         self.assertEqual(
             AnotherChild.objects.get(rel1_child__f1__endswith='baz'), c2
         )
+
+    def test_join_from_child_pointer(self):
+        # The remote foreign key points to Parent, but the join starts from
+        # AnotherChild's child_ptr, which has the same value as Parent's id.
+        field = AnotherChild._meta.get_field('rel1_child')
+        self.assertEqual([f.name for f in field.local_related_fields], ['child_ptr'])
+        qs = AnotherChild.objects.filter(rel1_child__f1='foo').values('pk')
+        sql = str(qs.query)
+        self.assertEqual(sql.count('JOIN'), 1)
+        self.assertIn('"reverse_unique_anotherchild"."child_ptr_id" = "reverse_unique_rel1"."parent_id"', sql)
+        self.assertEqual(str(AnotherChild.objects.exclude(rel1_child__f1='foo').values('pk').query).count('JOIN'), 1)
+        self.assertEqual(
+            str(AnotherChild.objects.filter(rel1_child__isnull=True).values('pk').query).count('JOIN'), 1)
+        # Loading the model's own fields needs the parent tables, but the
+        # ReverseUnique join doesn't go through them.
+        sql = str(AnotherChild.objects.select_related('rel1_child').query)
+        self.assertEqual(sql.count('JOIN'), 3)
+        self.assertIn('"reverse_unique_anotherchild"."child_ptr_id" = "reverse_unique_rel1"."parent_id"', sql)
+        c1 = AnotherChild.objects.create()
+        Rel1.objects.create(f1='foo', parent=c1)
+        with self.assertNumQueries(1):
+            self.assertEqual(AnotherChild.objects.filter(rel1_child__f1='foo').count(), 1)
+
+
+class FilterCacheTests(TestCase):
+    def setUp(self):
+        self.field = Article._meta.get_field('active_translation')
+        self.field.filter_cache_clear()
+
+    def test_restriction_is_cached_per_filter_value(self):
+        activate('fi')
+        str(Article.objects.filter(active_translation__title='foo').query)
+        str(Article.objects.filter(active_translation__title='bar').query)
+        info = self.field.filter_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+        activate('en')
+        sql = str(Article.objects.filter(active_translation__title='foo').query)
+        self.assertIn('= en', sql)
+        info = self.field.filter_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 2))
+
+    def test_cached_restriction_is_relabeled(self):
+        activate('fi')
+        fi = Lang.objects.create(code="fi")
+        a1 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=a1, lang=fi, title='Otsikko', body='')
+        inner = Article.objects.filter(active_translation__title='Otsikko').values('pk')
+        qs = Article.objects.filter(active_translation__title='Otsikko', pk__in=inner)
+        self.assertEqual(list(qs), [a1])
+        self.assertEqual(list(qs), [a1])
+        self.assertGreater(self.field.filter_cache_info().hits, 0)
+
+    def test_callable_filters_resolved_once(self):
+        # A callable returning another value on the next call (for example
+        # date.today() at midnight) mustn't cache one value under the key of
+        # the other.
+        filters = mock.Mock(side_effect=[Q(lang='fi'), Q(lang='en')])
+        with mock.patch.object(self.field, 'filters', filters):
+            sql = str(Article.objects.filter(active_translation__title='foo').query)
+        self.assertEqual(filters.call_count, 1)
+        self.assertIn('= fi', sql)
+        self.assertEqual(list(self.field._filter_cache), [self.field._filter_cache_key(Q(lang='fi'))])
+
+    def test_cache_is_bounded(self):
+        self.field.filter_cache_size = 2
+        try:
+            for lang in ('fi', 'en', 'sv'):
+                activate(lang)
+                str(Article.objects.filter(active_translation__title='foo').query)
+            self.assertEqual(self.field.filter_cache_info().currsize, 2)
+        finally:
+            del self.field.filter_cache_size
+
+
+class PrefetchTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        self.fi = Lang.objects.create(code="fi")
+        self.en = Lang.objects.create(code="en")
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        self.a2 = Article.objects.create(pub_date=datetime.date.today())
+        self.a3 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=self.a1, lang=self.fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=self.en, title='Title', body='')
+        ArticleTranslation.objects.create(article=self.a2, lang=self.fi, title='Toinen', body='')
+        ArticleTranslation.objects.create(article=self.a3, lang=self.en, title='Third', body='')
+
+    def test_prefetch_related(self):
+        with self.assertNumQueries(2):
+            articles = list(Article.objects.prefetch_related('active_translation').order_by('pk'))
+            self.assertEqual(
+                [a.active_translation and a.active_translation.title for a in articles],
+                ['Otsikko', 'Toinen', None])
+
+    def test_prefetch_object(self):
+        with self.assertNumQueries(2):
+            articles = list(Article.objects.prefetch_related(
+                models.Prefetch('active_translation',
+                                queryset=ArticleTranslation.objects.only('article', 'title'))
+            ).order_by('pk'))
+            self.assertEqual(articles[0].active_translation.title, 'Otsikko')
+            self.assertIsNone(articles[2].active_translation)
+        with self.assertNumQueries(2):
+            articles = list(Article.objects.prefetch_related(
+                models.Prefetch('active_translation', to_attr='prefetched_translation')
+            ).order_by('pk'))
+            self.assertEqual([a.prefetched_translation and a.prefetched_translation.title for a in articles],
+                             ['Otsikko', 'Toinen', None])
+
+    def test_prefetch_through_parent(self):
+        c1 = AnotherChild.objects.create()
+        c2 = AnotherChild.objects.create()
+        Rel1.objects.create(f1='foobar', parent=c1)
+        Rel1.objects.create(f1='barfoo', parent=c2)
+        with self.assertNumQueries(2):
+            children = list(AnotherChild.objects.prefetch_related('rel1_child').order_by('pk'))
+            self.assertEqual(children[0].rel1_child.f1, 'foobar')
+            self.assertIsNone(children[1].rel1_child)
+
+    def test_none_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.a3.active_translation)
+            self.assertIsNone(self.a3.active_translation)
+
+
+class VariantCacheTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        fi = Lang.objects.create(code="fi")
+        en = Lang.objects.create(code="en")
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=self.a1, lang=fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=en, title='Title', body='')
+
+    def test_language_switch(self):
+        a1 = Article.objects.get(pk=self.a1.pk)
+        with self.assertNumQueries(2):
+            self.assertEqual(a1.translation.title, 'Otsikko')
+            activate('en')
+            self.assertEqual(a1.translation.title, 'Title')
+        with self.assertNumQueries(0):
+            activate('fi')
+            self.assertEqual(a1.translation.title, 'Otsikko')
+            activate('en')
+            self.assertEqual(a1.translation.title, 'Title')
+        activate('sv')
+        with self.assertNumQueries(1):
+            self.assertIsNone(a1.translation)
+            self.assertIsNone(a1.translation)
+
+    def test_select_related_and_prefetch(self):
+        with self.assertNumQueries(1):
+            a1 = Article.objects.select_related('translation').get(pk=self.a1.pk)
+            self.assertEqual(a1.translation.title, 'Otsikko')
+        activate('en')
+        with self.assertNumQueries(1):
+            self.assertEqual(a1.translation.title, 'Title')
+        activate('fi')
+        with self.assertNumQueries(2):
+            a1 = Article.objects.prefetch_related('translation').get(pk=self.a1.pk)
+            self.assertEqual(a1.translation.title, 'Otsikko')
+        activate('en')
+        with self.assertNumQueries(1):
+            self.assertEqual(a1.translation.title, 'Title')
+
+    def test_delete_cached_value_clears_variants(self):
+        a1 = Article.objects.get(pk=self.a1.pk)
+        self.assertEqual(a1.translation.title, 'Otsikko')
+        Article._meta.get_field('translation').delete_cached_value(a1)
+        with self.assertNumQueries(1):
+            self.assertEqual(a1.translation.title, 'Otsikko')
+
+    def test_refresh_from_db_clears_variants(self):
+        a1 = Article.objects.get(pk=self.a1.pk)
+        self.assertEqual(a1.translation.title, 'Otsikko')
+        self.assertEqual(a1.active_translation.title, 'Otsikko')
+        ArticleTranslation.objects.filter(article=a1).update(title='Uusi')
+        a1.refresh_from_db()
+        self.assertEqual(a1.translation.title, 'Uusi')
+        self.assertEqual(a1.active_translation.title, 'Uusi')
+        # Refreshing other fields keeps the cache.
+        ArticleTranslation.objects.filter(article=a1).update(title='Uudempi')
+        a1.refresh_from_db(fields=['pub_date'])
+        with self.assertNumQueries(0):
+            self.assertEqual(a1.translation.title, 'Uusi')
+
+
+class PrefetchVariantsTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        fi = Lang.objects.create(code="fi")
+        en = Lang.objects.create(code="en")
+        Lang.objects.create(code="sv")
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        self.a2 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=self.a1, lang=fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=en, title='Title', body='')
+        ArticleTranslation.objects.create(article=self.a2, lang=en, title='Second', body='')
+
+    def test_queryset_prefetch_variants(self):
+        with self.assertNumQueries(2):
+            articles = list(Article.objects.order_by('pk').prefetch_variants(
+                'translation', lang=['fi', 'en', 'sv']))
+        with self.assertNumQueries(0):
+            activate('fi')
+            self.assertEqual([a.translation and a.translation.title for a in articles],
+                             ['Otsikko', None])
+            activate('en')
+            self.assertEqual([a.translation.title for a in articles], ['Title', 'Second'])
+            activate('sv')
+            self.assertEqual([a.translation for a in articles], [None, None])
+
+    def test_prefetch_variants_function(self):
+        articles = list(Article.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            prefetch_variants(articles, 'translation', lang=['en'])
+        activate('en')
+        with self.assertNumQueries(0):
+            self.assertEqual(articles[1].translation.title, 'Second')
+        activate('fi')
+        with self.assertNumQueries(1):
+            self.assertEqual(articles[0].translation.title, 'Otsikko')
+
+    def test_filters_with_other_conditions(self):
+        ArticleTranslation.objects.filter(title='Second').update(abstract='Abstract')
+        field = Article._meta.get_field('translation')
+        with mock.patch.object(field, 'filters', lambda: Q(lang=get_language(), abstract__isnull=True)):
+            with self.assertNumQueries(2):
+                articles = list(Article.objects.order_by('pk').prefetch_variants('translation', lang=['fi', 'en']))
+            with self.assertNumQueries(0):
+                self.assertEqual([a.translation and a.translation.title for a in articles], ['Otsikko', None])
+                activate('en')
+                self.assertEqual([a.translation and a.translation.title for a in articles], ['Title', None])
+
+    def test_filters_without_variant_condition(self):
+        field = Article._meta.get_field('translation')
+        msg = 'The filters of reverse_unique.Article.translation must be conditions combined with AND'
+        for filters in (Q(lang='fi') | Q(lang='en'), Q(title='Title')):
+            with mock.patch.object(field, 'filters', filters), self.assertRaisesMessage(ValueError, msg):
+                prefetch_variants(Article.objects.all(), 'translation', lang=['fi'])
+
+    def test_requires_cache_variants(self):
+        msg = 'prefetch_variants() requires a ReverseUnique field with cache_variants=True'
+        with self.assertRaisesMessage(ValueError, msg):
+            list(Article.objects.prefetch_variants('active_translation', lang=['fi']))
+
+
+class FallbackTests(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        self.a1 = DefaultTranslationArticle.objects.create(pub_date=today, default_lang="fi")
+        self.a2 = DefaultTranslationArticle.objects.create(pub_date=today, default_lang="en")
+        self.a3 = DefaultTranslationArticle.objects.create(pub_date=today, default_lang="sv")
+        DefaultTranslationArticleTranslation.objects.create(
+            article=self.a1, lang='fi', title='Otsikko', body='')
+        DefaultTranslationArticleTranslation.objects.create(
+            article=self.a1, lang='en', title='Title', body='')
+        DefaultTranslationArticleTranslation.objects.create(
+            article=self.a2, lang='en', title='B title', body='')
+
+    def test_descriptor(self):
+        activate('en')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.a1.translation.title, 'Title')
+        activate('fi')
+        a1 = DefaultTranslationArticle.objects.get(pk=self.a1.pk)
+        a2 = DefaultTranslationArticle.objects.get(pk=self.a2.pk)
+        with self.assertNumQueries(3):
+            self.assertEqual(a1.translation.title, 'Otsikko')
+            self.assertEqual(a2.translation.title, 'B title')
+            self.assertIsNone(self.a3.translation)
+
+    def test_select_related(self):
+        activate('fi')
+        with self.assertNumQueries(1):
+            articles = list(DefaultTranslationArticle.objects.select_related(
+                'translation').order_by('pk'))
+            self.assertEqual([a.translation and a.translation.title for a in articles],
+                             ['Otsikko', 'B title', None])
+
+    def test_filter_and_order_by(self):
+        activate('fi')
+        self.assertEqual(
+            list(DefaultTranslationArticle.objects.filter(
+                translation__isnull=False).order_by('-translation__title')),
+            [self.a1, self.a2])
+        self.assertEqual(
+            list(DefaultTranslationArticle.objects.filter(translation__title='B title')),
+            [self.a2])
+        activate('en')
+        self.assertEqual(
+            list(DefaultTranslationArticle.objects.filter(
+                translation__title__endswith='itle').order_by('translation__title')),
+            [self.a2, self.a1])
+        qs = DefaultTranslationArticle.objects.filter(translation__title='Title')
+        self.assertEqual(str(qs.query).count('JOIN'), 1)
+        inner = DefaultTranslationArticle.objects.filter(translation__title='Title')
+        self.assertEqual(
+            list(DefaultTranslationArticle.objects.filter(
+                translation__isnull=False, pk__in=inner.values('pk'))),
+            [self.a1])
+        self.assertEqual(
+            list(DefaultTranslationArticle.objects.exclude(
+                translation__title='Title').order_by('pk')),
+            [self.a2, self.a3])
+
+    def test_prefetch_related(self):
+        activate('sv')
+        with self.assertNumQueries(2):
+            articles = list(DefaultTranslationArticle.objects.prefetch_related(
+                'translation').order_by('pk'))
+            self.assertEqual([a.translation and a.translation.title for a in articles],
+                             ['Otsikko', 'B title', None])
+
+    def test_fallback_must_share_relation(self):
+        class BrokenFallbackChild(Child):
+            rel2_foo = ReverseUnique("Rel2", filters=Q(f1='foo'))
+            rel1_fallback = ReverseUnique("Rel1", fallback=('rel2_foo',))
+
+            class Meta:
+                app_label = 'reverse_unique'
+
+        msg = 'must be ReverseUnique fields of the same relation'
+        with self.assertRaisesMessage(ValueError, msg):
+            BrokenFallbackChild._meta.get_field('rel1_fallback').related_fields
+
+
+class MaterializeTests(TestCase):
+    def setUp(self):
+        self.today = datetime.date.today()
+        self.e1 = Employee.objects.create(name='Anssi')
+        self.e2 = Employee.objects.create(name='Mary')
+        self.old = EmployeeSalary.objects.create(
+            employee=self.e1, salary=10, valid_from=self.today - datetime.timedelta(days=10),
+            valid_until=self.today - datetime.timedelta(days=1))
+        self.current = EmployeeSalary.objects.create(
+            employee=self.e1, salary=11, valid_from=self.today)
+
+    def test_column_maintained_on_save(self):
+        e1 = Employee.objects.get(pk=self.e1.pk)
+        self.assertEqual(e1.current_salary_materialized_id, self.current.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(e1.current_salary.salary, 11)
+        e2 = Employee.objects.get(pk=self.e2.pk)
+        with self.assertNumQueries(0):
+            self.assertIsNone(e2.current_salary)
+
+    def test_queries_use_plain_join(self):
+        qs = Employee.objects.filter(current_salary__salary__gt=10)
+        self.assertEqual(list(qs), [self.e1])
+        sql = str(qs.query)
+        self.assertIn('current_salary_materialized_id', sql)
+        self.assertNotIn('valid_from', sql)
+        self.assertEqual(
+            list(Employee.objects.filter(current_salary__isnull=True)), [self.e2])
+        with self.assertNumQueries(1):
+            employees = list(Employee.objects.select_related('current_salary').order_by('pk'))
+            self.assertEqual([e.current_salary and e.current_salary.salary for e in employees],
+                             [11, None])
+
+    def test_delete(self):
+        self.current.delete()
+        self.assertIsNone(Employee.objects.get(pk=self.e1.pk).current_salary)
+        self.e1.delete()
+        self.assertFalse(EmployeeSalary.objects.exists())
+
+    def test_refresh_materialized(self):
+        EmployeeSalary.objects.bulk_create([
+            EmployeeSalary(employee=self.e2, salary=20, valid_from=self.today)])
+        self.assertIsNone(Employee.objects.get(pk=self.e2.pk).current_salary)
+        Employee.objects.filter(pk=self.e2.pk).refresh_materialized()
+        self.assertEqual(Employee.objects.get(pk=self.e2.pk).current_salary.salary, 20)
+        EmployeeSalary.objects.filter(pk=self.current.pk).update(
+            valid_from=self.today + datetime.timedelta(days=1))
+        Employee._meta.get_field('current_salary').refresh_materialized()
+        self.assertIsNone(Employee.objects.get(pk=self.e1.pk).current_salary)
+
+    def test_move_to_another_owner(self):
+        self.current.employee = self.e2
+        self.current.save()
+        self.assertIsNone(Employee.objects.get(pk=self.e1.pk).current_salary)
+        self.assertEqual(Employee.objects.get(pk=self.e2.pk).current_salary, self.current)
+
+    def test_filters_referring_to_owner(self):
+        article = DefaultTranslationArticle.objects.create(pub_date=self.today, default_lang='fi')
+        fi = DefaultTranslationArticleTranslation.objects.create(article=article, lang='fi', title='Otsikko')
+        en = DefaultTranslationArticleTranslation.objects.create(article=article, lang='en', title='Title')
+        article = DefaultTranslationArticle.objects.get(pk=article.pk)
+        self.assertEqual(article.stored_default_translation, fi)
+        article.default_lang = 'en'
+        article.save()
+        self.assertEqual(article.stored_default_translation, en)
+        article = DefaultTranslationArticle.objects.get(pk=article.pk)
+        self.assertEqual(article.stored_default_translation, en)
+        # Other materialized fields don't refresh on save of the owner.
+        with self.assertNumQueries(1):
+            self.e1.save()
+
+
+class RemoteIndexTests(TestCase):
+    def get_constraints(self, table):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(cursor, table)
+
+    def test_static_filters_unique_constraint(self):
+        constraint = Parent._meta.get_field('rel1').get_remote_index()
+        self.assertIsInstance(constraint, models.UniqueConstraint)
+        self.assertEqual(constraint.fields, ('parent',))
+        self.assertEqual(constraint.condition, Q(f1='foo'))
+        self.assertIn(constraint, Rel1._meta.constraints)
+        self.assertIn(constraint.name, self.get_constraints(Rel1._meta.db_table))
+        p1 = Parent.objects.create()
+        Rel1.objects.create(parent=p1, f1='foo')
+        Rel1.objects.create(parent=p1, f1='bar')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rel1.objects.create(parent=p1, f1='foo')
+
+    def test_callable_filters_composite_index(self):
+        index = Room._meta.get_field('current_reservation').get_remote_index()
+        self.assertIsInstance(index, models.Index)
+        self.assertEqual(index.fields, ['room', 'from_date', 'until_date'])
+        self.assertIn(index, Reservation._meta.indexes)
+        self.assertLessEqual(len(index.name), 30)
+        constraints = self.get_constraints(Reservation._meta.db_table)
+        self.assertEqual(constraints[index.name]['columns'],
+                         ['room_id', 'from_date', 'until_date'])
+
+    def test_filters_with_references_get_index(self):
+        index = DefaultTranslationArticle._meta.get_field('default_translation').get_remote_index()
+        self.assertIsInstance(index, models.Index)
+        self.assertEqual(index.fields, ['article', 'lang'])
+        self.assertIsNone(
+            DefaultTranslationArticle._meta.get_field('translation').get_remote_index())
+
+
+class PerformanceCheckTests(TestCase):
+    def check_ids(self, model, name, using='default'):
+        return [m.id for m in check_field(model._meta.get_field(name), using)]
+
+    def test_indexed_unique_join(self):
+        self.assertEqual(self.check_ids(Article, 'active_translation'), [])
+        self.assertEqual(self.check_ids(Parent, 'rel1'), [])
+        self.assertEqual(self.check_ids(Employee, 'current_salary'), [])
+
+    def test_unindexed_filter_columns(self):
+        self.assertEqual(self.check_ids(Child, 'rel2', using=None),
+                         ['reverse_unique.W002', 'reverse_unique.W003'])
+
+    def test_callable_filters_not_provably_unique(self):
+        self.assertEqual(self.check_ids(Room, 'current_reservation'), ['reverse_unique.W003'])
+
+    def test_management_command(self):
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'problem(s) found'):
+            call_command('check_reverse_unique', '--no-explain', stdout=out)
+        self.assertIn('reverse_unique.W002', out.getvalue())
+        self.assertIn('Child.rel2', out.getvalue())
+
+    def test_management_command_unknown_app(self):
+        with self.assertRaisesMessage(CommandError, "No installed app with label 'missing'"):
+            call_command('check_reverse_unique', 'missing', stdout=StringIO())
+        out = StringIO()
+        call_command('check_reverse_unique', 'reverse_unique_tests', '--no-explain', stdout=out)
+        self.assertIn('No problems found', out.getvalue())
+
+    def test_missing_tables_not_explained(self):
+        # The database checks run before migrate creates the tables.
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            self.assertEqual(check_query_plan(Article._meta.get_field('active_translation')), [])
+
+
+class DuplicateProbeTests(TestCase):
+    def setUp(self):
+        self.field = Child._meta.get_field('rel2')
+        self.field.probe_rate, self.field.probe_interval = 1, 0
+        self.field._init_probe_state()
+        self.c1 = Child.objects.create()
+        self.c2 = Child.objects.create()
+        Rel2.objects.create(child=self.c1, f1='foo')
+        Rel2.objects.create(child=self.c1, f1='foo')
+        Rel2.objects.create(child=self.c2, f1='foo')
+        Rel2.objects.create(child=self.c2, f1='bar')
+
+    def tearDown(self):
+        self.field.probe_rate, self.field.probe_interval = 0, 60
+        self.field._init_probe_state()
+
+    def test_find_duplicate_matches(self):
+        self.assertEqual(self.field.find_duplicate_matches(), [(self.c1.pk,)])
+
+    def test_probe_on_descriptor_miss(self):
+        received = []
+
+        def receiver(sender, field, values, using, **kwargs):
+            received.append((sender, field, values, using))
+        duplicate_match.connect(receiver)
+        self.addCleanup(duplicate_match.disconnect, receiver)
+        c2 = Child.objects.get(pk=self.c2.pk)
+        with self.assertLogs('reverse_unique', 'WARNING') as logs, self.assertNumQueries(2):
+            self.assertEqual(c2.rel2.f1, 'foo')
+        self.assertIn('Child.rel2 matches more than one', logs.output[0])
+        self.assertEqual(received, [(Child, self.field, [(self.c1.pk,)], 'default')])
+        # Cached access doesn't probe.
+        with self.assertNumQueries(0):
+            c2.rel2
+        self.assertEqual(self.field.probe_info(), (1, 1, 0))
+
+    def test_probe_rate_limit(self):
+        self.field.probe_interval = 3600
+        with self.assertLogs('reverse_unique', 'WARNING'):
+            Child.objects.get(pk=self.c2.pk).rel2
+        c2 = Child.objects.get(pk=self.c2.pk)
+        with self.assertNumQueries(1):
+            c2.rel2
+        self.assertEqual(self.field.probe_info(), (1, 1, 1))
+
+    def test_probe_after_select_related(self):
+        field = Article._meta.get_field('active_translation')
+        field.probe_rate, field.probe_interval = 1, 0
+        self.addCleanup(setattr, field, 'probe_rate', 0)
+        self.addCleanup(setattr, field, 'probe_interval', 60)
+        Article.objects.create(pub_date=datetime.date.today())
+        with self.assertNumQueries(2):
+            list(Article.objects.select_related('active_translation'))
+        self.assertEqual(field.probe_info().probes, 1)
+        self.assertEqual(field.probe_info().violations, 0)
+        field._init_probe_state()
+
+
+@skipUnless(django.VERSION >= (4, 1), "Async queries require Django 4.1.")
+class AsyncTests(TestCase):
+    def setUp(self):
+        fi = Lang.objects.create(code="fi")
+        en = Lang.objects.create(code="en")
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        self.a2 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=self.a1, lang=fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=en, title='Title', body='')
+
+    async def test_aget(self):
+        activate('fi')
+        a1 = await Article.objects.aget(pk=self.a1.pk)
+        translation = await a1.aget_active_translation()
+        self.assertEqual(translation.title, 'Otsikko')
+        self.assertTrue(Article.active_translation.is_cached(a1))
+        # Cached values are returned without queries, sync access works, too.
+        self.assertIs(a1.active_translation, translation)
+        a2 = await Article.objects.aget(pk=self.a2.pk)
+        self.assertIsNone(await a2.aget_active_translation())
+        self.assertIsNone(a2.active_translation)
+
+    async def test_aget_variants(self):
+        a1 = await Article.objects.aget(pk=self.a1.pk)
+        activate('fi')
+        self.assertEqual((await a1.aget_translation()).title, 'Otsikko')
+        activate('en')
+        self.assertEqual((await a1.aget_translation()).title, 'Title')
+        activate('fi')
+        self.assertEqual(a1.translation.title, 'Otsikko')
+
+    async def test_async_iteration_with_prefetch(self):
+        activate('fi')
+        articles = [a async for a in Article.objects.prefetch_related('active_translation').order_by('pk')]
+        self.assertEqual([a.active_translation and a.active_translation.title for a in articles],
+                         ['Otsikko', None])
+
+    async def test_aprefetch_variants(self):
+        articles = [a async for a in Article.objects.order_by('pk')]
+        await aprefetch_variants(articles, 'translation', lang=['fi', 'en'])
+        activate('en')
+        self.assertEqual(articles[0].translation.title, 'Title')
+        self.assertIsNone(articles[1].translation)
+
+
+class BatchLoadingTests(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        guest = Guest.objects.create(name="John")
+        self.rooms = [Room.objects.create() for i in range(3)]
+        self.reservations = [
+            Reservation.objects.create(room=room, guest=guest, from_date=today)
+            for room in self.rooms[:2]]
+        Reservation.objects.create(
+            room=self.rooms[2], guest=guest, from_date=today - datetime.timedelta(days=10),
+            until_date=today - datetime.timedelta(days=9))
+
+    def test_sync_batching(self):
+        with batch_loading():
+            rooms = [
+                Room.objects.get(pk=self.rooms[0].pk),
+                Room.objects.filter(pk=self.rooms[1].pk)[0],
+                list(Room.objects.filter(pk=self.rooms[2].pk))[0],
+            ]
+            with self.assertNumQueries(1):
+                self.assertEqual([room.current_reservation for room in rooms],
+                                 self.reservations + [None])
+        room = Room.objects.get(pk=self.rooms[0].pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(room.current_reservation, self.reservations[0])
+
+    def test_instances_not_kept_alive(self):
+        with batch_loading() as loader:
+            for room, reservation in iter_with_reverse_unique(Room.objects.all(), 'current_reservation'):
+                pass
+            del room, reservation
+            gc.collect()
+            self.assertEqual(sum(len(instances) for instances in loader._instances.values()), 0)
+
+    def test_sync_batching_variants(self):
+        fi = Lang.objects.create(code="fi")
+        en = Lang.objects.create(code="en")
+        articles = [Article.objects.create(pub_date=datetime.date.today()) for i in range(2)]
+        for article in articles:
+            ArticleTranslation.objects.create(article=article, lang=fi, title='Otsikko', body='')
+            ArticleTranslation.objects.create(article=article, lang=en, title='Title', body='')
+        with batch_loading():
+            articles = [Article.objects.get(pk=article.pk) for article in articles]
+            with self.assertNumQueries(2):
+                activate('fi')
+                self.assertEqual([a.translation.title for a in articles], ['Otsikko'] * 2)
+                activate('en')
+                self.assertEqual([a.translation.title for a in articles], ['Title'] * 2)
+                activate('fi')
+                self.assertEqual([a.translation.title for a in articles], ['Otsikko'] * 2)
+
+    @skipUnless(django.VERSION >= (4, 1), "Async queries require Django 4.1.")
+    async def test_async_batching(self):
+        field = Room._meta.get_field('current_reservation')
+        with batch_loading(), mock.patch.object(field, '_load_batch', wraps=field._load_batch) as load:
+            rooms = [await Room.objects.aget(pk=room.pk) for room in self.rooms]
+            reservations = await asyncio.gather(*[room.aget_current_reservation() for room in rooms])
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(list(reservations), self.reservations + [None])
+        self.assertEqual(rooms[0].current_reservation, self.reservations[0])
+
+
+class SharedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.field = Article._meta.get_field('cached_translation')
+        activate('fi')
+        self.fi = Lang.objects.create(code="fi")
+        self.en = Lang.objects.create(code="en")
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        self.a2 = Article.objects.create(pub_date=datetime.date.today())
+        self.t1 = ArticleTranslation.objects.create(
+            article=self.a1, lang=self.fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=self.en, title='Title', body='')
+        self.field._init_shared_cache_info()
+
+    def get(self, article, name='cached_translation'):
+        return getattr(Article.objects.get(pk=article.pk), name)
+
+    def test_descriptor(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get(self.a1).title, 'Otsikko')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.a1).title, 'Otsikko')
+        # Absence is cached, too.
+        with self.assertNumQueries(2):
+            self.assertIsNone(self.get(self.a2))
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.get(self.a2))
+        # The filter value is part of the key.
+        activate('en')
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get(self.a1).title, 'Title')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.a1).title, 'Title')
+        self.assertEqual(self.field.shared_cache_info(), (3, 3, 0))
+
+    def test_invalidation(self):
+        self.get(self.a1)
+        self.t1.title = 'Uusi otsikko'
+        self.t1.save()
+        self.assertEqual(self.get(self.a1).title, 'Uusi otsikko')
+        self.t1.delete()
+        self.assertIsNone(self.get(self.a1))
+        self.assertIsNone(self.get(self.a2))
+        t2 = ArticleTranslation.objects.create(article=self.a2, lang=self.fi, title='Toinen', body='')
+        self.assertEqual(self.get(self.a2), t2)
+        # Moving a remote object invalidates the previous instance, too.
+        t2.article = self.a1
+        t2.save()
+        self.assertIsNone(self.get(self.a2))
+        self.assertEqual(self.get(self.a1), t2)
+        self.assertEqual(self.field.shared_cache_info().invalidations, 4)
+
+    def test_get_many(self):
+        a3 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=a3, lang=self.fi, title='Kolmas', body='')
+        self.get(self.a1)
+        articles = list(Article.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            translations = self.field.cache_get_many(articles)
+        self.assertEqual([t and t.title for t in translations], ['Otsikko', None, 'Kolmas'])
+        articles = list(Article.objects.order_by('pk'))
+        with self.assertNumQueries(0):
+            self.field.cache_get_many(articles)
+            self.assertEqual(articles[2].cached_translation.title, 'Kolmas')
+
+
+class PrefetchedEvaluationTests(TestCase):
+    def test_callable_filters(self):
+        today = datetime.date.today()
+        guest = Guest.objects.create(name="John")
+        room = Room.objects.create()
+        Reservation.objects.create(
+            room=room, guest=guest, from_date=today - datetime.timedelta(days=10),
+            until_date=today - datetime.timedelta(days=9))
+        current = Reservation.objects.create(room=room, guest=guest, from_date=today)
+        Room.objects.create()
+        with self.assertNumQueries(2):
+            rooms = list(Room.objects.prefetch_related('reservations').order_by('pk'))
+        with self.assertNumQueries(0):
+            self.assertEqual([r.current_reservation for r in rooms], [current, None])
+
+    def test_fk_values_and_owner_references(self):
+        activate('fi')
+        fi = Lang.objects.create(code='fi')
+        a1 = Article.objects.create(pub_date=datetime.date.today())
+        t1 = ArticleTranslation.objects.create(article=a1, lang=fi, title='Otsikko', body='')
+        a1 = Article.objects.prefetch_related('articletranslation_set').get()
+        with self.assertNumQueries(0):
+            self.assertEqual(a1.active_translation, t1)
+        d1 = DefaultTranslationArticle.objects.create(pub_date=datetime.date.today(), default_lang='en')
+        en = DefaultTranslationArticleTranslation.objects.create(article=d1, lang='en', title='Title')
+        d1 = DefaultTranslationArticle.objects.prefetch_related(
+            'defaulttranslationarticletranslation_set').get()
+        with self.assertNumQueries(0):
+            self.assertEqual(d1.default_translation, en)
+            self.assertIsNone(d1.active_translation)
+            self.assertEqual(d1.translation, en)
+
+    def test_filtered_prefetch_uses_sql(self):
+        p1 = Parent.objects.create()
+        rel = Rel1.objects.create(parent=p1, f1='foo')
+        Rel1.objects.create(parent=p1, f1='bar')
+        p1 = Parent.objects.prefetch_related(
+            Prefetch('rel1list', queryset=Rel1.objects.filter(f1='bar'))).get()
+        with self.assertNumQueries(1):
+            self.assertEqual(p1.rel1, rel)
+
+    def test_evaluator(self):
+        evaluator = FilterEvaluator(Reservation, 'room')
+        today = datetime.date.today()
+        reservation = Reservation(from_date=today, until_date=None, guest_id=1)
+        self.assertTrue(evaluator.evaluate(Q(from_date__lte=today) & Q(until_date__isnull=True), reservation))
+        self.assertFalse(evaluator.evaluate(~Q(from_date=today.isoformat()), reservation))
+        self.assertTrue(evaluator.evaluate(Q(guest__in=[1, 2]) | Q(from_date__gt=today), reservation))
+        self.assertFalse(evaluator.evaluate(Q(until_date__gte=today), reservation))
+        self.assertTrue(evaluator.evaluate(Q(from_date=F('from_date')), reservation))
+        for filters in [Q(guest__name='John'), Q(from_date__year=2000), Q(from_date=F('room__pk__foo')),
+                        Q(from_date=F('until_date')), Q(guest__in=[1, None])]:
+            with self.assertRaises(CannotEvaluate):
+                evaluator.evaluate(filters, reservation)
+
+    def test_evaluator_collation(self):
+        evaluator = FilterEvaluator(Rel1, 'parent')
+        rel = Rel1(f1='FOObar')
+        self.assertTrue(evaluator.evaluate(Q(f1='FOObar'), rel))
+        self.assertFalse(evaluator.evaluate(Q(f1='foo'), rel))
+        for filters in [Q(f1='foobar'), Q(f1__in=['x', 'foobär']), Q(f1__startswith='FOO'), Q(f1__gt='a')]:
+            with self.assertRaises(CannotEvaluate):
+                evaluator.evaluate(filters, rel)
+
+    def test_mixed_case_matches_database(self):
+        child = AnotherChild.objects.create()
+        Rel1.objects.create(parent=child, f1='FOObar')
+        expected = AnotherChild.objects.get().rel1_child
+        child = AnotherChild.objects.prefetch_related('rel1list').get()
+        self.assertEqual(child.rel1_child, expected)
+
+
+class SubqueryTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        fi = Lang.objects.create(code='fi')
+        en = Lang.objects.create(code='en')
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        self.a2 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=self.a1, lang=fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=en, title='Title', body='')
+        ArticleTranslation.objects.create(article=self.a2, lang=en, title='Title 2', body='')
+
+    def test_exists(self):
+        qs = Article.objects.filter(ReverseUniqueExists('active_translation'))
+        self.assertSequenceEqual(qs, [self.a1])
+        sql = str(qs.query)
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('JOIN', sql)
+        self.assertSequenceEqual(Article.objects.filter(~ReverseUniqueExists('active_translation')), [self.a2])
+        self.assertSequenceEqual(
+            Article.objects.filter(ReverseUniqueExists('active_translation', title__startswith='X')), [])
+        activate('en')
+        self.assertEqual(Article.objects.filter(ReverseUniqueExists('active_translation')).count(), 2)
+
+    def test_subquery(self):
+        qs = Article.objects.annotate(
+            title=ReverseUniqueSubquery('active_translation__title')).order_by('pk')
+        self.assertEqual([a.title for a in qs], ['Otsikko', None])
+        self.assertNotIn('JOIN', str(qs.query))
+        self.assertSequenceEqual(
+            Article.objects.filter(pk__in=ReverseUniqueSubquery('active_translation__article')), [self.a1])
+
+    def test_references_and_fallback(self):
+        d1 = DefaultTranslationArticle.objects.create(pub_date=datetime.date.today(), default_lang='en')
+        DefaultTranslationArticleTranslation.objects.create(article=d1, lang='en', title='Title')
+        DefaultTranslationArticle.objects.create(pub_date=datetime.date.today(), default_lang='fi')
+        qs = DefaultTranslationArticle.objects.annotate(
+            title=ReverseUniqueSubquery('translation__title'),
+            has_default=ReverseUniqueExists('default_translation')).order_by('pk')
+        self.assertEqual([(a.title, a.has_default) for a in qs], [('Title', True), (None, False)])
+
+    def test_materialized(self):
+        e1 = Employee.objects.create(name='Joe')
+        EmployeeSalary.objects.create(employee=e1, salary=1000, valid_from=datetime.date.today())
+        self.assertEqual(
+            Employee.objects.annotate(salary=ReverseUniqueSubquery('current_salary__salary')).get().salary, 1000)
+
+
+class OrderByTests(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        self.john = Guest.objects.create(name="John")
+        self.jane = Guest.objects.create(name="Jane")
+        self.room1 = Room.objects.create()
+        self.room2 = Room.objects.create()
+        self.room3 = Room.objects.create()
+        self.r1 = Reservation.objects.create(
+            room=self.room1, guest=self.john, from_date=today - datetime.timedelta(days=10),
+            until_date=today - datetime.timedelta(days=8))
+        self.r2 = Reservation.objects.create(
+            room=self.room1, guest=self.jane, from_date=today - datetime.timedelta(days=5),
+            until_date=today - datetime.timedelta(days=9))
+        self.r3 = Reservation.objects.create(room=self.room1, guest=self.john, from_date=today)
+        self.r4 = Reservation.objects.create(room=self.room2, guest=self.jane, from_date=today)
+
+    def test_descriptor(self):
+        room1 = Room.objects.get(pk=self.room1.pk)
+        self.assertEqual(room1.latest_reservation, self.r3)
+        self.assertEqual(room1.last_finished_reservation, self.r1)
+        room2 = Room.objects.get(pk=self.room2.pk)
+        self.assertEqual(room2.latest_reservation, self.r4)
+        self.assertIsNone(room2.last_finished_reservation)
+
+    def test_join(self):
+        qs = Room.objects.filter(latest_reservation__guest=self.john)
+        self.assertSequenceEqual(qs, [self.room1])
+        self.assertSequenceEqual(
+            Room.objects.filter(last_finished_reservation__guest__name='Jane'), [])
+        self.assertSequenceEqual(
+            Room.objects.order_by('latest_reservation__guest__name', 'pk'),
+            [self.room3, self.room2, self.room1])
+        with self.assertNumQueries(1):
+            rooms = list(Room.objects.select_related(
+                'latest_reservation__guest', 'last_finished_reservation').order_by('pk'))
+            self.assertEqual(
+                [(r.latest_reservation and r.latest_reservation.guest.name, r.last_finished_reservation)
+                 for r in rooms],
+                [('John', self.r1), ('Jane', None), (None, None)])
+
+    def test_prefetch(self):
+        with self.assertNumQueries(2):
+            rooms = list(Room.objects.prefetch_related('latest_reservation').order_by('pk'))
+            self.assertEqual([r.latest_reservation for r in rooms], [self.r3, self.r4, None])
+
+    def test_remote_index_and_checks(self):
+        field = Room._meta.get_field('last_finished_reservation')
+        index = field.get_remote_index()
+        self.assertEqual(index.fields, ['room', 'until_date'])
+        self.assertNotIn('reverse_unique.W003', [m.id for m in check_field(field)])
+
+
+class MultiColumnTests(TestCase):
+    def setUp(self):
+        self.p1 = TenantParent.objects.create(tenant_id=1)
+        self.c1 = TenantChild.objects.create(tenant_id=2, child_tenant_id=2)
+        self.c2 = TenantChild.objects.create(tenant_id=3, child_tenant_id=3)
+        self.item1 = TenantItem.objects.create(tenant_id=1, owner_id=self.p1.pk, kind='main')
+        self.item2 = TenantItem.objects.create(tenant_id=2, owner_id=self.c1.pk, kind='main')
+        # Same owner id, wrong tenant.
+        TenantItem.objects.create(tenant_id=1, owner_id=self.c2.pk, kind='main')
+
+    def test_direct(self):
+        self.assertEqual(TenantParent.objects.get(pk=self.p1.pk).main_item, self.item1)
+        self.assertSequenceEqual(
+            TenantParent.objects.filter(main_item__isnull=False).order_by('pk').values_list('pk', flat=True),
+            [self.p1.pk, self.c1.pk])
+
+    @isolate_apps('reverse_unique')
+    def test_concrete_foreign_key_preferred(self):
+        class Owner(models.Model):
+            item = ReverseUnique('Item', filters=Q(kind='main'))
+
+        class Item(models.Model):
+            owner = models.ForeignKey(Owner, on_delete=models.CASCADE)
+            owner_alias = models.ForeignObject(
+                Owner, on_delete=models.CASCADE, from_fields=['owner'], to_fields=['id'], related_name='+')
+            kind = models.CharField(max_length=10)
+
+        field = Owner._meta.get_field('item')
+        self.assertEqual(field.warm_up(), [])
+        self.assertEqual(field.remote_fk.name, 'owner')
+
+    def test_parent_join(self):
+        field = TenantChild._meta.get_field('child_main_item')
+        self.assertEqual([f.name for f in field.local_related_fields], ['child_tenant_id', 'tenantparent_ptr'])
+        qs = TenantChild.objects.filter(child_main_item__kind='main')
+        self.assertSequenceEqual(qs, [self.c1])
+        # The join goes straight to the child table.
+        sql = str(qs.query)
+        self.assertIn('"reverse_unique_tenantchild"."tenant_id" = "reverse_unique_tenantitem"."tenant_id"', sql)
+        self.assertIn('"reverse_unique_tenantchild"."tenantparent_ptr_id" = "reverse_unique_tenantitem"."owner_id"', sql)
+        with self.assertNumQueries(1):
+            children = list(TenantChild.objects.select_related('child_main_item').order_by('pk'))
+            self.assertEqual([c.child_main_item for c in children], [self.item2, None])
+        self.assertEqual(TenantChild.objects.get(pk=self.c1.pk).child_main_item, self.item2)
+        self.assertIsNone(TenantChild.objects.get(pk=self.c2.pk).child_main_item)
+
+
+class BulkWriteTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        self.today = datetime.date.today()
+        self.e1 = Employee.objects.create(name='Joe')
+        self.e2 = Employee.objects.create(name='Jane')
+        self.old = EmployeeSalary.objects.create(
+            employee=self.e1, salary=900, valid_from=self.today - datetime.timedelta(days=30),
+            valid_until=self.today - datetime.timedelta(days=1))
+        self.s1 = EmployeeSalary.objects.create(employee=self.e1, salary=1000, valid_from=self.today)
+        self.s2 = EmployeeSalary.objects.create(employee=self.e2, salary=2000, valid_from=self.today)
+
+    def test_update_related(self):
+        # One UPDATE for the salaries, one refreshing the materialized column.
+        with self.assertNumQueries(2):
+            sql = str(Employee._meta.get_field('current_salary').get_matching_queryset(
+                Employee.objects.filter(name='Joe')).query)
+            self.assertIn('IN (SELECT', sql)
+            rows = Employee.objects.filter(name='Joe').update_related('current_salary', salary=F('salary') * 2)
+        self.assertEqual(rows, 1)
+        self.assertEqual(
+            list(EmployeeSalary.objects.order_by('pk').values_list('salary', flat=True)), [900, 2000, 2000])
+
+    def test_update_related_refreshes_materialized(self):
+        Employee.objects.all().update_related('current_salary', valid_from=self.today + datetime.timedelta(days=1))
+        self.assertEqual(Employee.objects.filter(current_salary__isnull=True).count(), 2)
+
+    def test_update_related_join_filters(self):
+        fi = Lang.objects.create(code='fi')
+        a1 = Article.objects.create(pub_date=self.today)
+        t1 = ArticleTranslation.objects.create(article=a1, lang=fi, title='Otsikko', body='')
+        Article.objects.update_related('cached_translation', title='Uusi')
+        t1.refresh_from_db()
+        self.assertEqual(t1.title, 'Uusi')
+
+    def test_replace_related(self):
+        field = Employee._meta.get_field('current_salary')
+        e1 = Employee.objects.get(pk=self.e1.pk)
+        self.assertEqual(e1.current_salary, self.s1)
+        e2 = Employee.objects.get(pk=self.e2.pk)
+        created = field.replace_related([
+            (e1, EmployeeSalary(salary=1100, valid_from=self.today)),
+            (e2, EmployeeSalary(salary=2200, valid_from=self.today)),
+        ])
+        self.assertEqual([s.employee_id for s in created], [self.e1.pk, self.e2.pk])
+        self.assertEqual(e1.current_salary.salary, 1100)
+        self.assertEqual(
+            sorted(EmployeeSalary.objects.values_list('salary', flat=True)), [900, 1100, 2200])
+        self.assertEqual(
+            [e.current_salary.salary for e in Employee.objects.order_by('pk')], [1100, 2200])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.field = Parent._meta.get_field('rel1')
+        self.p1 = Parent.objects.create()
+        self.p2 = Parent.objects.create()
+        Rel1.objects.create(parent=self.p1, f1='foo')
+
+    def test_descriptor_events(self):
+        p1 = Parent.objects.get(pk=self.p1.pk)
+        p2 = Parent.objects.get(pk=self.p2.pk)
+        with collect_stats() as stats:
+            self.assertEqual(p1.rel1.f1, 'foo')
+            p1.rel1
+            self.assertIsNone(p2.rel1)
+        self.assertEqual(dict(stats.counts['reverse_unique.Parent.rel1']), {
+            'cache_miss': 2, 'cache_hit': 1, 'query': 2, 'none_result': 1,
+        })
+        self.assertGreater(stats.durations['reverse_unique.Parent.rel1']['query'], 0)
+        # The default collector is back in place.
+        self.assertFalse(get_collector().enabled)
+
+    def test_restriction_build(self):
+        self.field._init_filter_cache()
+        with collect_stats() as stats:
+            list(Parent.objects.select_related('rel1'))
+            list(Parent.objects.select_related('rel1'))
+        self.assertEqual(stats.total('restriction_build'), 1)
+        self.assertEqual(stats.total('query'), 0)
+
+    def test_batch_query(self):
+        with collect_stats() as stats, batch_loading():
+            parents = list(Parent.objects.order_by('pk'))
+            self.assertEqual([p.rel1 is None for p in parents], [False, True])
+        self.assertEqual(stats.get('reverse_unique.Parent.rel1', 'query'), 1)
+        self.assertEqual(stats.total('none_result'), 1)
+
+    @skipUnless(django.VERSION >= (4, 1), "Async queries require Django 4.1.")
+    async def test_async_events(self):
+        p2 = await Parent.objects.aget(pk=self.p2.pk)
+        with collect_stats() as stats:
+            self.assertIsNone(await Parent.rel1.aget(p2))
+            self.assertIsNone(await Parent.rel1.aget(p2))
+        self.assertEqual(dict(stats.counts['reverse_unique.Parent.rel1']), {
+            'cache_miss': 1, 'cache_hit': 1, 'query': 1, 'none_result': 2,
+        })
+
+    def test_signal_collector(self):
+        received = []
+
+        def receiver(sender, field, event, duration, **kwargs):
+            received.append((sender, field, event, duration is None))
+        field_event.connect(receiver)
+        self.addCleanup(field_event.disconnect, receiver)
+        previous = set_collector(SignalCollector())
+        self.addCleanup(set_collector, previous)
+        Parent.objects.get(pk=self.p1.pk).rel1
+        self.assertEqual(received, [
+            (Parent, self.field, 'query', False),
+            (Parent, self.field, 'cache_miss', True),
+        ])
+
+
+class SharedJoinTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        fi = Lang.objects.create(code='fi')
+        en = Lang.objects.create(code='en')
+        self.a1 = Article.objects.create(pub_date=datetime.date.today())
+        self.a2 = Article.objects.create(pub_date=datetime.date.today())
+        ArticleTranslation.objects.create(article=self.a1, lang=fi, title='Otsikko', body='')
+        ArticleTranslation.objects.create(article=self.a1, lang=en, title='Title', body='')
+        ArticleTranslation.objects.create(article=self.a2, lang=en, title='Title 2', body='')
+
+    def test_fields_with_equal_filters(self):
+        qs = Article.objects.select_related('active_translation', 'translation').order_by('pk')
+        self.assertEqual(str(qs.query).count('JOIN'), 1)
+        with self.assertNumQueries(1):
+            a1, a2 = qs
+            self.assertEqual(a1.active_translation.title, 'Otsikko')
+            self.assertEqual(a1.translation.title, 'Otsikko')
+            self.assertIsNone(a2.translation)
+        qs = Article.objects.filter(active_translation__title='Otsikko', translation__isnull=False)
+        self.assertEqual(str(qs.query).count('JOIN'), 1)
+        self.assertSequenceEqual(qs, [self.a1])
+
+    def test_same_field_in_filter_order_by_and_select_related(self):
+        qs = Article.objects.filter(active_translation__title__startswith='O').order_by(
+            'active_translation__title').select_related('active_translation')
+        self.assertEqual(str(qs.query).count('JOIN'), 1)
+        self.assertEqual([a.active_translation.title for a in qs], ['Otsikko'])
+
+    def test_different_filters(self):
+        qs = DefaultTranslationArticle.objects.select_related('active_translation', 'default_translation')
+        self.assertEqual(str(qs.query).count('JOIN'), 2)
+        qs = Room.objects.select_related('current_reservation', 'latest_reservation')
+        self.assertEqual(str(qs.query).count('JOIN'), 2)
+
+    def test_filters_change(self):
+        qs = Article.objects.filter(active_translation__title='Title', translation__title='Title')
+        activate('en')
+        self.assertSequenceEqual(qs, [self.a1])
+        self.assertEqual(str(qs.query).count('JOIN'), 1)
+
+
+class AutoSelectTests(TestCase):
+    def setUp(self):
+        activate('fi')
+        self.b1 = Book.objects.create()
+        self.b2 = Book.objects.create()
+        BookTranslation.objects.create(book=self.b1, lang='fi', title='Otsikko', body='Diipadaapa')
+
+    def test_fetch(self):
+        with self.assertNumQueries(1):
+            b1, b2 = Book.objects.order_by('pk')
+            self.assertEqual(b1.translation.title, 'Otsikko')
+            self.assertIsNone(b2.translation)
+        # Only auto_select_fields are loaded.
+        self.assertEqual(b1.translation.get_deferred_fields(), {'book_id', 'lang', 'body'})
+        with self.assertNumQueries(1):
+            self.assertEqual(b1.translation.body, 'Diipadaapa')
+
+    def test_get_and_iterator(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Book.objects.get(pk=self.b1.pk).translation.title, 'Otsikko')
+        with self.assertNumQueries(1):
+            titles = [b.translation and b.translation.title for b in Book.objects.order_by('pk').iterator()]
+        self.assertEqual(titles, ['Otsikko', None])
+
+    def test_explicit_select_related_loads_all_fields(self):
+        b1 = Book.objects.select_related('translation').get(pk=self.b1.pk)
+        self.assertEqual(b1.translation.get_deferred_fields(), set())
+
+    def test_without_auto_select(self):
+        qs = Book.objects.without_auto_select().order_by('pk')
+        with self.assertNumQueries(3):
+            for book in qs.filter(pk__isnull=False):
+                book.translation
+        self.assertNotIn('JOIN', str(qs.query))
+
+    def test_query_not_changed(self):
+        qs = Book.objects.all()
+        list(qs)
+        self.assertNotIn('JOIN', str(qs.query))
+        self.assertNotIn('JOIN', str(qs.filter(pk=self.b1.pk).query))
+        # Not even while an iterator is suspended.
+        qs = Book.objects.order_by('pk')
+        books = qs.iterator()
+        next(books)
+        self.assertNotIn('JOIN', str(qs.filter(pk=self.b1.pk).query))
+        self.assertEqual(next(books).pk, self.b2.pk)
+
+    def test_select_for_update(self):
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            list(Book.objects.select_for_update())
+        self.assertNotIn('JOIN', queries[0]['sql'])
+
+    def test_only_and_values(self):
+        with self.assertNumQueries(2):
+            b1 = Book.objects.only('pk').get(pk=self.b1.pk)
+            b1.translation
+        self.assertEqual(list(Book.objects.filter(pk=self.b1.pk).values_list('pk', flat=True)), [self.b1.pk])
+
+    def test_deconstruct(self):
+        kwargs = Book._meta.get_field('translation').deconstruct()[3]
+        self.assertIs(kwargs['auto_select'], True)
+        self.assertEqual(kwargs['auto_select_fields'], ('title',))
+
+
+class WarmUpTests(TestCase):
+    def check_ids(self, model, name):
+        return [e.id for e in model._meta.get_field(name).warm_up()]
+
+    def test_warm_field(self):
+        field = Room._meta.get_field('latest_reservation')
+        self.assertEqual(field.warm_up(), [])
+        self.assertIn('related_fields', field.__dict__)
+        field._init_filter_cache()
+        self.assertEqual(field.warm_up(), [])
+        # The static filters are compiled once.
+        with self.assertNumQueries(1):
+            list(Room.objects.select_related('latest_reservation'))
+        self.assertEqual((field._filter_cache_hits, field._filter_cache_misses), (1, 1))
+
+    @isolate_apps('reverse_unique')
+    def test_no_remote_foreign_key(self):
+        class NoRelation(models.Model):
+            rel = ReverseUnique(Rel1, filters=Q(f1='foo'))
+
+        self.assertEqual(self.check_ids(NoRelation, 'rel'), ['reverse_unique.E001'])
+
+    @isolate_apps('reverse_unique')
+    def test_misconfigured_remote_index(self):
+        class Owner(models.Model):
+            item = ReverseUnique('Item', filters=Q(kind='main'), remote_index=True)
+
+        class Item(models.Model):
+            first = models.ForeignKey(Owner, on_delete=models.CASCADE, related_name='+')
+            second = models.ForeignKey(Owner, on_delete=models.CASCADE, related_name='+')
+            kind = models.CharField(max_length=10)
+
+        app_config = django_apps.get_app_config('reverse_unique')
+        with mock.patch('reverse_unique.apps.apps.get_models', return_value=[Owner]):
+            app_config.ready()
+        self.assertEqual(Item._meta.indexes, [])
+        self.assertEqual(self.check_ids(Owner, 'item'), ['reverse_unique.E001'])
+        self.assertEqual(check_field(Owner._meta.get_field('item'), using='default'), [])
+
+    @isolate_apps('reverse_unique')
+    def test_parent_link_missing(self):
+        class FailingChild(Parent):
+            rev_uniq = ReverseUnique(Rel3, filters=())
+
+        errors = FailingChild._meta.get_field('rev_uniq').warm_up()
+        self.assertEqual([e.id for e in errors], ['reverse_unique.E002'])
+        self.assertIn('The field(s) uniq_field of model reverse_unique.Parent', errors[0].msg)
+
+    @isolate_apps('reverse_unique')
+    def test_broken_fallback(self):
+        class BrokenFallbackChild(Child):
+            rel2_foo = ReverseUnique(Rel2, filters=Q(f1='foo'))
+            rel1_fallback = ReverseUnique(Rel1, fallback=('rel2_foo',))
+            rel1_missing = ReverseUnique(Rel1, fallback=('missing',))
+
+        self.assertEqual(self.check_ids(BrokenFallbackChild, 'rel1_fallback'), ['reverse_unique.E003'])
+        self.assertEqual(self.check_ids(BrokenFallbackChild, 'rel1_missing'), ['reverse_unique.E003'])
+
+    @isolate_apps('reverse_unique')
+    def test_invalid_filters(self):
+        class InvalidFilters(Parent):
+            rel = ReverseUnique(Rel1, filters=Q(missing='foo'))
+            callable_rel = ReverseUnique(Rel1, filters=lambda: Q(missing='foo'))
+
+        self.assertEqual(self.check_ids(InvalidFilters, 'rel'), ['reverse_unique.E004'])
+        # Callable filters are only resolved in queries.
+        self.assertEqual(self.check_ids(InvalidFilters, 'callable_rel'), [])
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        guest = Guest.objects.create(name='John')
+        self.rooms = [Room.objects.create() for i in range(3)]
+        Reservation.objects.create(room=self.rooms[0], guest=guest, from_date=today)
+        Reservation.objects.create(
+            room=self.rooms[0], guest=guest, from_date=today - datetime.timedelta(days=10),
+            until_date=today - datetime.timedelta(days=5))
+        self.current = Reservation.objects.create(room=self.rooms[2], guest=guest, from_date=today)
+
+    def test_instances(self):
+        with self.assertNumQueries(3):
+            pairs = list(iter_with_reverse_unique(Room.objects.order_by('pk'), 'current_reservation', chunk_size=2))
+            self.assertEqual(pairs[2], (self.rooms[2], self.current))
+            # The matches are cached.
+            self.assertEqual([room.current_reservation for room, match in pairs], [match for room, match in pairs])
+        self.assertEqual([match is None for room, match in pairs], [False, True, False])
+
+    def test_values(self):
+        qs = Room.objects.order_by('pk')
+        with self.assertNumQueries(2):
+            pairs = list(iter_with_reverse_unique(qs, 'current_reservation', fields=['guest__name', 'until_date']))
+        self.assertEqual([match for room, match in pairs], [
+            {'guest__name': 'John', 'until_date': None}, None, {'guest__name': 'John', 'until_date': None},
+        ])
+        self.assertFalse(Room.current_reservation.is_cached(pairs[0][0]))
+
+    def test_materialized(self):
+        employee = Employee.objects.create(name='Jane')
+        EmployeeSalary.objects.create(employee=employee, salary=100, valid_from=datetime.date.today())
+        Employee.objects.create(name='Joe')
+        Employee.objects.refresh_materialized()
+        pairs = Employee.objects.order_by('pk').iter_with_reverse_unique('current_salary', fields=['salary'])
+        self.assertEqual([match for employee, match in pairs], [{'salary': 100}, None])
+
+    def test_multi_column(self):
+        parent = TenantParent.objects.create(tenant_id=1)
+        TenantItem.objects.create(tenant_id=1, owner_id=parent.pk, kind='main')
+        TenantItem.objects.create(tenant_id=1, owner_id=parent.pk, kind='other')
+        pairs = list(iter_with_reverse_unique(TenantParent.objects.all(), 'main_item', fields=['kind']))
+        self.assertEqual(pairs, [(parent, {'kind': 'main'})])
+
+    def test_requires_reverse_unique(self):
+        with self.assertRaisesMessage(ValueError, 'requires a ReverseUnique field'):
+            next(iter_with_reverse_unique(Room.objects.all(), 'id'))